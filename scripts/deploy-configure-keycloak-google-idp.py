@@ -13,110 +13,45 @@ Usage:
 
 from __future__ import annotations
 
-import json
-import os
 import sys
-import urllib.error
-import urllib.parse
-import urllib.request
 from pathlib import Path
 
+from deploy_keycloak_common import admin_api, get_admin_token, get_env
+
 GOOGLE_IDP_ALIAS = "google"
 GOOGLE_PROVIDER_ID = "google"
 
 
-def load_env_file(path: Path) -> dict[str, str]:
-    out: dict[str, str] = {}
-    if not path.is_file():
-        return out
-    for line in path.read_text().splitlines():
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        if "=" in line:
-            k, _, v = line.partition("=")
-            out[k.strip()] = v.strip().strip('"').strip("'")
-    return out
-
-
-def get_env(root: Path) -> dict[str, str]:
-    env: dict[str, str] = {}
-    env.update(load_env_file(root / ".env"))
-    for k, v in os.environ.items():
-        if v is not None:
-            env[k] = v
-    return env
-
-
-def get_admin_token(base_url: str, admin_password: str) -> str:
-    url = f"{base_url.rstrip('/')}/realms/master/protocol/openid-connect/token"
-    data = urllib.parse.urlencode({
-        "grant_type": "password",
-        "client_id": "admin-cli",
-        "username": "admin",
-        "password": admin_password,
-    }).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Content-Type", "application/x-www-form-urlencoded")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            body = json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Admin token failed: {e.code} {body}")
-    token = body.get("access_token")
-    if not token:
-        sys.exit("No access_token in token response")
-    return token
-
-
 def list_identity_providers(base_url: str, realm: str, token: str) -> list[dict]:
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/identity-provider/instances"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"List identity providers failed: {e.code} {body}")
+    return admin_api(
+        base_url, token, "GET", f"/admin/realms/{realm}/identity-provider/instances",
+        "List identity providers",
+    )
 
 
 def create_identity_provider(
     base_url: str, realm: str, payload: dict, token: str
 ) -> None:
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/identity-provider/instances"
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Create identity provider failed: {e.code} {body}")
+    admin_api(
+        base_url, token, "POST", f"/admin/realms/{realm}/identity-provider/instances",
+        "Create identity provider", payload,
+    )
 
 
 def update_identity_provider(
     base_url: str, realm: str, alias: str, payload: dict, token: str
 ) -> None:
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/identity-provider/instances/{alias}"
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="PUT")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Update identity provider failed: {e.code} {body}")
+    admin_api(
+        base_url, token, "PUT", f"/admin/realms/{realm}/identity-provider/instances/{alias}",
+        "Update identity provider", payload,
+    )
 
 
 def main() -> None:
     root = Path(__file__).resolve().parent.parent
     env = get_env(root)
 
-    base_url = env.get("KEYCLOAK_URL", "http://localhost:8080").strip()
+    base_url = env.get("KEYCLOAK_URL", "http://localhost:8080").strip().rstrip("/")
     admin_password = env.get("KEYCLOAK_ADMIN_PASSWORD", "").strip()
     realm = env.get("KEYCLOAK_REALM", "kairos-dev").strip()
     client_id = env.get("GOOGLE_CLIENT_ID", "").strip()
@@ -41,6 +41,9 @@ from scripts/keycloak/import relative to repo root (works regardless of CWD).
    also **kairos-operator**; optional **KAIROS_CI_TEST_USERNAME** (default **kairos-ci-tester**)
    → **ci-test** only.
 
+Steps 1–4b run concurrently, one worker per realm (realms share no state); 5–7 run after
+all realms are configured.
+
 Identity providers (e.g. Google) are not in realm JSON; configure via deploy-configure-keycloak-google-idp.py.
 
 Env: KEYCLOAK_URL (default http://localhost:8080), KEYCLOAK_ADMIN_PASSWORD,
@@ -58,6 +61,10 @@ the script expands **kairos-mcp** `redirectUris` and `webOrigins` for `localhost
 per port (max span 256 ports). Import JSON lists 3300–3301 as documentation; applied config
 comes from these env vars when you run this script.
 
+KEYCLOAK_SPARSE_REALM_PUT=1 (optional) — PUT only the managed realm keys, clients and flows from the
+import (Keycloak ids stripped) instead of the current realm merged with the import. Smaller payload;
+relies on realm PUT leaving absent fields unchanged.
+
 Loaded from .env.
 
 Usage:
@@ -67,16 +74,24 @@ Usage:
 
 from __future__ import annotations
 
+import functools
 import json
-import os
 import re
 import subprocess
 import sys
+import threading
 import urllib.error
 import urllib.parse
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from deploy_keycloak_common import admin_api, admin_create, get_admin_token, get_env, json_loads
+
+try:
+    import docker
+except ImportError:  # optional; without the SDK the network scan shells out to the docker CLI
+    docker = None
+
 CLIENT_REGISTRATION_POLICY_TYPE = "org.keycloak.services.clientregistration.policy.ClientRegistrationPolicy"
 TRUSTED_HOSTS_PROVIDER_ID = "trusted-hosts"
 # UI label "Allowed Client Scopes"; providerId is allowed-client-templates (Keycloak Admin API).
@@ -115,6 +130,15 @@ CLIENT_OPTIONAL_SCOPES = ("profile", "email", "offline_access")
 _DEV_APP_PORT_RANGE_MAX_SPAN = 256
 
 
+_LOG_LOCK = threading.Lock()
+
+
+def _log(*args: object, **kwargs: object) -> None:
+    """print() that keeps lines from parallel realm workers intact."""
+    with _LOG_LOCK:
+        print(*args, **kwargs)
+
+
 def _parse_port_env(env: dict, key: str, default: int) -> int:
     raw = (env.get(key) or "").strip()
     if not raw:
@@ -205,114 +229,59 @@ def apply_kairos_mcp_dev_client_urls(desired: dict, env: dict, realm_name: str)
         break
 
 
+def _prune_desired_realm(desired: object, path: Path) -> dict:
+    """
+    Validate an import file and keep only what this script applies: managed top-level keys,
+    clients and flows (other keys were never sent). Null fields are dropped from clients so
+    the overlay and PUT body carry only values Keycloak acts on.
+    """
+    if not isinstance(desired, dict):
+        sys.exit(f"{path}: realm import must be a JSON object")
+    pruned = {k: v for k, v in desired.items() if k in _REALM_IMPORT_KEYS}
+    clients = pruned.get("clients")
+    if clients is not None:
+        if not isinstance(clients, list) or not all(isinstance(c, dict) and c.get("clientId") for c in clients):
+            sys.exit(f"{path}: clients must be a list of objects with a clientId")
+        pruned["clients"] = [{k: v for k, v in c.items() if v is not None} for c in clients]
+    return pruned
+
+
 def load_desired_realm(path: Path, env: dict, realm_name: str) -> dict:
-    desired = json.loads(path.read_text())
+    desired = _prune_desired_realm(json_loads(path.read_bytes()), path)
     apply_kairos_mcp_dev_client_urls(desired, env, realm_name)
     return desired
 
 
-def load_env_file(path: Path) -> dict[str, str]:
-    out: dict[str, str] = {}
-    if not path.is_file():
-        return out
-    for line in path.read_text().splitlines():
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        if "=" in line:
-            k, _, v = line.partition("=")
-            out[k.strip()] = v.strip().strip('"').strip("'")
-    return out
-
-
-def get_env(root: Path) -> dict[str, str]:
-    env: dict[str, str] = {}
-    for name in (".env",):
-        env.update(load_env_file(root / name))
-    for k, v in os.environ.items():
-        if v is not None:
-            env[k] = v
-    return env
-
-
-def get_admin_token(base_url: str, admin_password: str) -> str:
-    url = f"{base_url.rstrip('/')}/realms/master/protocol/openid-connect/token"
-    data = urllib.parse.urlencode({
-        "grant_type": "password",
-        "client_id": "admin-cli",
-        "username": "admin",
-        "password": admin_password,
-    }).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Content-Type", "application/x-www-form-urlencoded")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            body = json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Admin token failed: {e.code} {body}")
-    token = body.get("access_token")
-    if not token:
-        sys.exit("No access_token in token response")
-    return token
-
-
-def list_realms(base_url: str, token: str) -> list[str]:
-    url = f"{base_url.rstrip('/')}/admin/realms"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
+def create_realm_minimal(base_url: str, token: str, realm_name: str) -> bool:
+    """Create realm with Keycloak defaults so we can then apply our config via update (idempotent)."""
     try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            realms = json.loads(resp.read().decode())
-            return [r["realm"] for r in realms]
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"List realms failed: {e.code} {body}")
+        admin_api(
+            base_url, token, "POST", "/admin/realms", f"Create realm {realm_name}",
+            {"realm": realm_name, "enabled": True}, allow=(409,),
+        )
+    except urllib.error.HTTPError:
+        return False
+    return True
 
 
-def create_realm_minimal(base_url: str, token: str, realm_name: str) -> bool:
-    """Create realm with Keycloak defaults so we can then apply our config via update (idempotent)."""
-    url = f"{base_url.rstrip('/')}/admin/realms"
-    payload = json.dumps({"realm": realm_name, "enabled": True}).encode("utf-8")
-    req = urllib.request.Request(url, data=payload, method="POST")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
+def find_realm_full(base_url: str, realm_name: str, token: str) -> dict | None:
+    """GET full realm representation, or None when the realm does not exist yet (404)."""
     try:
-        urllib.request.urlopen(req, timeout=15)
-        return True
-    except urllib.error.HTTPError as e:
-        if e.code == 409:
-            return False
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Create realm {realm_name} failed: {e.code} {body}")
-    return False
+        return admin_api(
+            base_url, token, "GET", f"/admin/realms/{realm_name}", f"GET realm {realm_name}", allow=(404,)
+        )
+    except urllib.error.HTTPError:
+        return None
 
 
 def get_realm_full(base_url: str, realm_name: str, token: str) -> dict:
     """GET full realm representation (for merge before PUT)."""
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"GET realm {realm_name} failed: {e.code} {body}")
+    return admin_api(base_url, token, "GET", f"/admin/realms/{realm_name}", f"GET realm {realm_name}")
 
 
 def update_realm(base_url: str, realm_name: str, realm_json: dict, token: str) -> None:
     """PUT realm to apply merged configuration (idempotent update)."""
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}"
-    payload = json.dumps(realm_json).encode("utf-8")
-    req = urllib.request.Request(url, data=payload, method="PUT")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Update realm {realm_name} failed: {e.code} {body}")
+    admin_api(base_url, token, "PUT", f"/admin/realms/{realm_name}", f"Update realm {realm_name}", realm_json)
 
 
 def list_realm_client_ids(base_url: str, realm_name: str, token: str) -> set[str]:
@@ -323,15 +292,10 @@ def list_realm_client_ids(base_url: str, realm_name: str, token: str) -> set[str
 
 def get_realm_clients(base_url: str, realm_name: str, token: str) -> list[dict]:
     """GET full list of client representations (for dump/compare)."""
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}/clients"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"List clients {realm_name} failed: {e.code} {body}")
+    return admin_api(
+        base_url, token, "GET", f"/admin/realms/{realm_name}/clients",
+        f"List clients {realm_name}",
+    )
 
 
 def push_kairos_mcp_redirect_config(
@@ -355,7 +319,7 @@ def push_kairos_mcp_redirect_config(
     clients = get_realm_clients(base_url, realm_name, token)
     existing = next((c for c in clients if c.get("clientId") == "kairos-mcp"), None)
     if not existing or not existing.get("id"):
-        print(f"  WARNING: kairos-mcp not found in {realm_name}; skip redirect push.", file=sys.stderr)
+        _log(f"  WARNING: kairos-mcp not found in {realm_name}; skip redirect push.", file=sys.stderr)
         return
 
     internal_id = existing["id"]
@@ -370,33 +334,21 @@ def push_kairos_mcp_redirect_config(
         merged.update(att)
         patch["attributes"] = merged
 
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}/clients/{internal_id}"
-    payload = json.dumps(patch).encode("utf-8")
-    req = urllib.request.Request(url, data=payload, method="PUT")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"PUT kairos-mcp client in {realm_name} failed: {e.code} {body}")
+    admin_api(
+        base_url, token, "PUT", f"/admin/realms/{realm_name}/clients/{internal_id}",
+        f"PUT kairos-mcp client in {realm_name}", patch,
+    )
 
     n = len(patch.get("redirectUris") or [])
-    print(f"  kairos-mcp redirect URIs set via Clients API ({realm_name}, {n} URIs).")
+    _log(f"  kairos-mcp redirect URIs set via Clients API ({realm_name}, {n} URIs).")
 
 
 def create_realm_client(base_url: str, realm_name: str, client_payload: dict, token: str) -> None:
     """POST a client into the realm (Keycloak realm PUT does not create new clients)."""
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}/clients"
-    payload = json.dumps(client_payload).encode("utf-8")
-    req = urllib.request.Request(url, data=payload, method="POST")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Create client {client_payload.get('clientId', '?')} in {realm_name} failed: {e.code} {body}")
+    admin_api(
+        base_url, token, "POST", f"/admin/realms/{realm_name}/clients",
+        f"Create client {client_payload.get('clientId', '?')} in {realm_name}", client_payload,
+    )
 
 
 def get_client_internal_id_by_client_id(
@@ -413,19 +365,11 @@ def get_client_internal_id_by_client_id(
 def list_client_protocol_mappers(
     base_url: str, realm_name: str, client_uuid: str, token: str
 ) -> list[dict]:
-    url = (
-        f"{base_url.rstrip('/')}/admin/realms/{realm_name}/clients/"
-        f"{client_uuid}/protocol-mappers/models"
+    raw = admin_api(
+        base_url, token, "GET", f"/admin/realms/{realm_name}/clients/{client_uuid}/protocol-mappers/models",
+        f"List protocol mappers {realm_name} client={client_uuid}",
     )
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            raw = json.loads(resp.read().decode())
-            return raw if isinstance(raw, list) else []
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"List protocol mappers {realm_name} client={client_uuid} failed: {e.code} {body}")
+    return raw if isinstance(raw, list) else []
 
 
 def _oidc_group_membership_mapper_config(full_path: bool) -> dict[str, str]:
@@ -478,20 +422,12 @@ def ensure_kairos_oidc_group_mapper_for_client(
             "protocolMapper": KAIROS_OIDC_GROUP_MAPPER_PROVIDER,
             "config": merged_cfg,
         }
-        url = (
-            f"{base_url.rstrip('/')}/admin/realms/{realm_name}/clients/"
-            f"{client_uuid}/protocol-mappers/models/{mapper_id}"
+        admin_api(
+            base_url, token, "PUT",
+            f"/admin/realms/{realm_name}/clients/{client_uuid}/protocol-mappers/models/{mapper_id}",
+            f"PUT group mapper {realm_name} {client_label}", body,
         )
-        payload = json.dumps(body).encode("utf-8")
-        req = urllib.request.Request(url, data=payload, method="PUT")
-        req.add_header("Authorization", f"Bearer {token}")
-        req.add_header("Content-Type", "application/json")
-        try:
-            urllib.request.urlopen(req, timeout=15)
-        except urllib.error.HTTPError as e:
-            err_body = e.read().decode() if e.fp else ""
-            sys.exit(f"PUT group mapper {realm_name} {client_label} failed: {e.code} {err_body}")
-        print(f"  Updated OIDC group mapper ({realm_name}, {client_label})")
+        _log(f"  Updated OIDC group mapper ({realm_name}, {client_label})")
         return
 
     create_body = {
@@ -500,38 +436,21 @@ def ensure_kairos_oidc_group_mapper_for_client(
         "protocolMapper": KAIROS_OIDC_GROUP_MAPPER_PROVIDER,
         "config": desired_cfg,
     }
-    url = (
-        f"{base_url.rstrip('/')}/admin/realms/{realm_name}/clients/"
-        f"{client_uuid}/protocol-mappers/models"
+    admin_api(
+        base_url, token, "POST", f"/admin/realms/{realm_name}/clients/{client_uuid}/protocol-mappers/models",
+        f"POST group mapper {realm_name} {client_label}", create_body,
     )
-    payload = json.dumps(create_body).encode("utf-8")
-    req = urllib.request.Request(url, data=payload, method="POST")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        err_body = e.read().decode() if e.fp else ""
-        sys.exit(f"POST group mapper {realm_name} {client_label} failed: {e.code} {err_body}")
-    print(f"  Added OIDC group mapper ({realm_name}, {client_label})")
+    _log(f"  Added OIDC group mapper ({realm_name}, {client_label})")
 
 
 def list_client_scope_protocol_mappers(
     base_url: str, realm_name: str, scope_id: str, token: str
 ) -> list[dict]:
-    url = (
-        f"{base_url.rstrip('/')}/admin/realms/{realm_name}/client-scopes/"
-        f"{scope_id}/protocol-mappers/models"
+    raw = admin_api(
+        base_url, token, "GET", f"/admin/realms/{realm_name}/client-scopes/{scope_id}/protocol-mappers/models",
+        f"List scope protocol mappers {realm_name} scope={scope_id}",
     )
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            raw = json.loads(resp.read().decode())
-            return raw if isinstance(raw, list) else []
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"List scope protocol mappers {realm_name} scope={scope_id} failed: {e.code} {body}")
+    return raw if isinstance(raw, list) else []
 
 
 def ensure_kairos_oidc_group_mapper_for_client_scope(
@@ -565,20 +484,12 @@ def ensure_kairos_oidc_group_mapper_for_client_scope(
             "protocolMapper": KAIROS_OIDC_GROUP_MAPPER_PROVIDER,
             "config": merged_cfg,
         }
-        url = (
-            f"{base_url.rstrip('/')}/admin/realms/{realm_name}/client-scopes/"
-            f"{scope_id}/protocol-mappers/models/{mapper_id}"
+        admin_api(
+            base_url, token, "PUT",
+            f"/admin/realms/{realm_name}/client-scopes/{scope_id}/protocol-mappers/models/{mapper_id}",
+            f"PUT scope group mapper {realm_name} {scope_label}", body,
         )
-        payload = json.dumps(body).encode("utf-8")
-        req = urllib.request.Request(url, data=payload, method="PUT")
-        req.add_header("Authorization", f"Bearer {token}")
-        req.add_header("Content-Type", "application/json")
-        try:
-            urllib.request.urlopen(req, timeout=15)
-        except urllib.error.HTTPError as e:
-            err_body = e.read().decode() if e.fp else ""
-            sys.exit(f"PUT scope group mapper {realm_name} {scope_label} failed: {e.code} {err_body}")
-        print(f"  Updated OIDC group mapper (scope {realm_name}, {scope_label})")
+        _log(f"  Updated OIDC group mapper (scope {realm_name}, {scope_label})")
         return
 
     create_body = {
@@ -587,51 +498,40 @@ def ensure_kairos_oidc_group_mapper_for_client_scope(
         "protocolMapper": KAIROS_OIDC_GROUP_MAPPER_PROVIDER,
         "config": desired_cfg,
     }
-    url = (
-        f"{base_url.rstrip('/')}/admin/realms/{realm_name}/client-scopes/"
-        f"{scope_id}/protocol-mappers/models"
+    admin_api(
+        base_url, token, "POST", f"/admin/realms/{realm_name}/client-scopes/{scope_id}/protocol-mappers/models",
+        f"POST scope group mapper {realm_name} {scope_label}", create_body,
     )
-    payload = json.dumps(create_body).encode("utf-8")
-    req = urllib.request.Request(url, data=payload, method="POST")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        err_body = e.read().decode() if e.fp else ""
-        sys.exit(f"POST scope group mapper {realm_name} {scope_label} failed: {e.code} {err_body}")
-    print(f"  Added OIDC group mapper (scope {realm_name}, {scope_label})")
+    _log(f"  Added OIDC group mapper (scope {realm_name}, {scope_label})")
 
 
 def ensure_kairos_groups_client_scope(base_url: str, realm_name: str, token: str) -> str:
     scopes = list_realm_client_scopes(base_url, realm_name, token)
     scope_row = next((s for s in scopes if s.get("name") == KAIROS_GROUPS_CLIENT_SCOPE_NAME), None)
     if not scope_row:
-        url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}/client-scopes"
-        payload = json.dumps({
-            "name": KAIROS_GROUPS_CLIENT_SCOPE_NAME,
-            "protocol": "openid-connect",
-            "attributes": {
-                "include.in.token.scope": "true",
-                "display.on.consent.screen": "false",
-            },
-        }).encode("utf-8")
-        req = urllib.request.Request(url, data=payload, method="POST")
-        req.add_header("Authorization", f"Bearer {token}")
-        req.add_header("Content-Type", "application/json")
         try:
-            urllib.request.urlopen(req, timeout=15)
-        except urllib.error.HTTPError as e:
-            if e.code != 409:
-                body = e.read().decode() if e.fp else ""
-                sys.exit(f"Create client scope {KAIROS_GROUPS_CLIENT_SCOPE_NAME} in {realm_name} failed: {e.code} {body}")
+            admin_api(
+                base_url, token, "POST", f"/admin/realms/{realm_name}/client-scopes",
+                f"Create client scope {KAIROS_GROUPS_CLIENT_SCOPE_NAME} in {realm_name}",
+                {
+                    "name": KAIROS_GROUPS_CLIENT_SCOPE_NAME,
+                    "protocol": "openid-connect",
+                    "attributes": {
+                        "include.in.token.scope": "true",
+                        "display.on.consent.screen": "false",
+                    },
+                },
+                allow=(409,),
+            )
+        except urllib.error.HTTPError:
+            pass  # Created concurrently; re-read below.
         scopes = list_realm_client_scopes(base_url, realm_name, token)
         scope_row = next((s for s in scopes if s.get("name") == KAIROS_GROUPS_CLIENT_SCOPE_NAME), None)
         if not scope_row:
             sys.exit(f"Client scope {KAIROS_GROUPS_CLIENT_SCOPE_NAME} missing in {realm_name} after create attempt")
-        print(f"  Created client scope '{KAIROS_GROUPS_CLIENT_SCOPE_NAME}' in {realm_name}")
+        _log(f"  Created client scope '{KAIROS_GROUPS_CLIENT_SCOPE_NAME}' in {realm_name}")
     else:
-        print(f"  Client scope '{KAIROS_GROUPS_CLIENT_SCOPE_NAME}' already present in {realm_name}")
+        _log(f"  Client scope '{KAIROS_GROUPS_CLIENT_SCOPE_NAME}' already present in {realm_name}")
 
     scope_id = scope_row.get("id")
     if not isinstance(scope_id, str) or not scope_id:
@@ -643,15 +543,10 @@ def ensure_kairos_groups_client_scope(base_url: str, realm_name: str, token: str
 
 
 def list_default_client_scopes(base_url: str, realm_name: str, token: str) -> list[dict]:
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}/default-default-client-scopes"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"GET default client scopes {realm_name} failed: {e.code} {body}")
+    return admin_api(
+        base_url, token, "GET", f"/admin/realms/{realm_name}/default-default-client-scopes",
+        f"GET default client scopes {realm_name}",
+    )
 
 
 def ensure_default_client_scope(
@@ -663,31 +558,22 @@ def ensure_default_client_scope(
 ) -> None:
     defaults = list_default_client_scopes(base_url, realm_name, token)
     if any(s.get("name") == scope_name for s in defaults):
-        print(f"  '{scope_name}' already in default client scopes ({realm_name})")
+        _log(f"  '{scope_name}' already in default client scopes ({realm_name})")
         return
-    add_url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}/default-default-client-scopes/{scope_id}"
-    put_req = urllib.request.Request(add_url, data=b"", method="PUT")
-    put_req.add_header("Authorization", f"Bearer {token}")
-    try:
-        urllib.request.urlopen(put_req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Add {scope_name} to default client scopes {realm_name} failed: {e.code} {body}")
-    print(f"  Linked '{scope_name}' to default client scopes ({realm_name})")
+    admin_api(
+        base_url, token, "PUT", f"/admin/realms/{realm_name}/default-default-client-scopes/{scope_id}",
+        f"Add {scope_name} to default client scopes {realm_name}",
+    )
+    _log(f"  Linked '{scope_name}' to default client scopes ({realm_name})")
 
 
 def list_client_default_scopes(
     base_url: str, realm_name: str, client_uuid: str, token: str
 ) -> list[dict]:
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}/clients/{client_uuid}/default-client-scopes"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"GET client default scopes {realm_name} client={client_uuid} failed: {e.code} {body}")
+    return admin_api(
+        base_url, token, "GET", f"/admin/realms/{realm_name}/clients/{client_uuid}/default-client-scopes",
+        f"GET client default scopes {realm_name} client={client_uuid}",
+    )
 
 
 def ensure_client_default_scope(
@@ -701,31 +587,19 @@ def ensure_client_default_scope(
     defaults = list_client_default_scopes(base_url, realm_name, client_uuid, token)
     if any(s.get("name") == scope_name for s in defaults):
         return
-    add_url = (
-        f"{base_url.rstrip('/')}/admin/realms/{realm_name}/clients/"
-        f"{client_uuid}/default-client-scopes/{scope_id}"
+    admin_api(
+        base_url, token, "PUT", f"/admin/realms/{realm_name}/clients/{client_uuid}/default-client-scopes/{scope_id}",
+        f"Add {scope_name} to client default scopes {realm_name} client={client_uuid}",
     )
-    put_req = urllib.request.Request(add_url, data=b"", method="PUT")
-    put_req.add_header("Authorization", f"Bearer {token}")
-    try:
-        urllib.request.urlopen(put_req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Add {scope_name} to client default scopes {realm_name} client={client_uuid} failed: {e.code} {body}")
 
 
 def list_client_optional_scopes(
     base_url: str, realm_name: str, client_uuid: str, token: str
 ) -> list[dict]:
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}/clients/{client_uuid}/optional-client-scopes"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"GET client optional scopes {realm_name} client={client_uuid} failed: {e.code} {body}")
+    return admin_api(
+        base_url, token, "GET", f"/admin/realms/{realm_name}/clients/{client_uuid}/optional-client-scopes",
+        f"GET client optional scopes {realm_name} client={client_uuid}",
+    )
 
 
 def ensure_client_optional_scope(
@@ -739,17 +613,10 @@ def ensure_client_optional_scope(
     optionals = list_client_optional_scopes(base_url, realm_name, client_uuid, token)
     if any(s.get("name") == scope_name for s in optionals):
         return
-    add_url = (
-        f"{base_url.rstrip('/')}/admin/realms/{realm_name}/clients/"
-        f"{client_uuid}/optional-client-scopes/{scope_id}"
+    admin_api(
+        base_url, token, "PUT", f"/admin/realms/{realm_name}/clients/{client_uuid}/optional-client-scopes/{scope_id}",
+        f"Add {scope_name} to client optional scopes {realm_name} client={client_uuid}",
     )
-    put_req = urllib.request.Request(add_url, data=b"", method="PUT")
-    put_req.add_header("Authorization", f"Bearer {token}")
-    try:
-        urllib.request.urlopen(put_req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Add {scope_name} to client optional scopes {realm_name} client={client_uuid} failed: {e.code} {body}")
 
 
 def remove_kairos_oidc_group_mapper_from_client(
@@ -766,31 +633,20 @@ def remove_kairos_oidc_group_mapper_from_client(
     mapper_id = existing.get("id")
     if not isinstance(mapper_id, str) or not mapper_id:
         sys.exit(f"{realm_name} client {client_label}: mapper {KAIROS_OIDC_GROUP_MAPPER_NAME!r} has no id")
-    url = (
-        f"{base_url.rstrip('/')}/admin/realms/{realm_name}/clients/"
-        f"{client_uuid}/protocol-mappers/models/{mapper_id}"
+    admin_api(
+        base_url, token, "DELETE",
+        f"/admin/realms/{realm_name}/clients/{client_uuid}/protocol-mappers/models/{mapper_id}",
+        f"DELETE group mapper {realm_name} {client_label}",
     )
-    req = urllib.request.Request(url, method="DELETE")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        err_body = e.read().decode() if e.fp else ""
-        sys.exit(f"DELETE group mapper {realm_name} {client_label} failed: {e.code} {err_body}")
-    print(f"  Removed legacy OIDC group mapper ({realm_name}, {client_label})")
+    _log(f"  Removed legacy OIDC group mapper ({realm_name}, {client_label})")
 
 
 def list_realm_client_scopes(base_url: str, realm_name: str, token: str) -> list[dict]:
     """GET realm-defined client scopes (templates)."""
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}/client-scopes"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"List client scopes {realm_name} failed: {e.code} {body}")
+    return admin_api(
+        base_url, token, "GET", f"/admin/realms/{realm_name}/client-scopes",
+        f"List client scopes {realm_name}",
+    )
 
 
 def ensure_openid_client_scope(base_url: str, realm_name: str, token: str) -> str:
@@ -809,41 +665,39 @@ def ensure_openid_client_scope(base_url: str, realm_name: str, token: str) -> st
     scopes = list_realm_client_scopes(base_url, realm_name, token)
     openid_row = next((s for s in scopes if s.get("name") == "openid"), None)
     if not openid_row:
-        url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}/client-scopes"
-        payload = json.dumps({
-            "name": "openid",
-            "protocol": "openid-connect",
-            "attributes": {
-                "include.in.token.scope": "true",
-                "display.on.consent.screen": "false",
-            },
-        }).encode("utf-8")
-        req = urllib.request.Request(url, data=payload, method="POST")
-        req.add_header("Authorization", f"Bearer {token}")
-        req.add_header("Content-Type", "application/json")
         try:
-            urllib.request.urlopen(req, timeout=15)
-        except urllib.error.HTTPError as e:
-            if e.code != 409:
-                body = e.read().decode() if e.fp else ""
-                sys.exit(f"Create client scope openid in {realm_name} failed: {e.code} {body}")
+            admin_api(
+                base_url, token, "POST", f"/admin/realms/{realm_name}/client-scopes",
+                f"Create client scope openid in {realm_name}",
+                {
+                    "name": "openid",
+                    "protocol": "openid-connect",
+                    "attributes": {
+                        "include.in.token.scope": "true",
+                        "display.on.consent.screen": "false",
+                    },
+                },
+                allow=(409,),
+            )
+        except urllib.error.HTTPError:
+            pass  # Created concurrently; re-read below.
         scopes = list_realm_client_scopes(base_url, realm_name, token)
         openid_row = next((s for s in scopes if s.get("name") == "openid"), None)
         if not openid_row:
             sys.exit(f"Client scope openid missing in {realm_name} after create attempt")
-        print(f"  Created client scope 'openid' in {realm_name}")
+        _log(f"  Created client scope 'openid' in {realm_name}")
     else:
-        print(f"  Client scope 'openid' already present in {realm_name}")
+        _log(f"  Client scope 'openid' already present in {realm_name}")
 
     scope_id = openid_row["id"]
 
     # Remove from optional defaults if present (legacy from earlier config).
-    opt_url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}/default-optional-client-scopes/{scope_id}"
-    del_req = urllib.request.Request(opt_url, method="DELETE")
-    del_req.add_header("Authorization", f"Bearer {token}")
     try:
-        urllib.request.urlopen(del_req, timeout=15)
-        print(f"  Removed 'openid' from optional client scopes ({realm_name})")
+        admin_api(
+            base_url, token, "DELETE", f"/admin/realms/{realm_name}/default-optional-client-scopes/{scope_id}",
+            f"Remove openid from optional client scopes {realm_name}", allow=range(400, 600),
+        )
+        _log(f"  Removed 'openid' from optional client scopes ({realm_name})")
     except urllib.error.HTTPError:
         pass  # Not in optional — fine.
 
@@ -852,6 +706,37 @@ def ensure_openid_client_scope(base_url: str, realm_name: str, token: str) -> st
     return scope_id
 
 
+# Top-level realm keys applied from import JSON (desired overwrites current); verify compares the same set.
+_REALM_MERGE_KEYS = (
+    "realm", "enabled", "registrationAllowed", "loginWithEmailAllowed", "duplicateEmailsAllowed",
+    "ssoSessionIdleTimeout", "ssoSessionMaxLifespan", "accessTokenLifespan",
+    "accessCodeLifespan", "accessCodeLifespanUserAction", "accessCodeLifespanLogin", "groups",
+)
+# Everything load_desired_realm keeps from an import file.
+_REALM_IMPORT_KEYS = frozenset({"id", *_REALM_MERGE_KEYS, "clients", "authenticationFlows"})
+
+
+def _merge_keyed_list(current_items: list[dict], desired_items: list[dict], key: str, overlay: bool) -> list[dict]:
+    """
+    Merge desired list entries into current ones matched by `key` (clientId / alias). Current
+    entries not in desired are kept first. Matched entries keep the Keycloak-assigned `id`;
+    with overlay, desired fields are laid over the existing entry instead of replacing it.
+    """
+    desired_keys = {d.get(key) for d in desired_items if d.get(key)}
+    current_by_key = {c[key]: c for c in current_items if c.get(key)}
+    merged = [c for c in current_items if c.get(key) not in desired_keys]
+    for d_item in desired_items:
+        k = d_item.get(key)
+        if not k:
+            continue
+        existing = current_by_key.get(k)
+        new_item = {**existing, **d_item} if existing and overlay else dict(d_item)
+        if existing and existing.get("id") is not None:
+            new_item["id"] = existing["id"]
+        merged.append(new_item)
+    return merged
+
+
 def _merge_realm(current: dict, desired: dict) -> dict:
     """
     Merge desired realm JSON into current (from GET). Preserves Keycloak-assigned ids
@@ -861,48 +746,22 @@ def _merge_realm(current: dict, desired: dict) -> dict:
 
     # Top-level realm attributes: desired overwrites (keep current id)
     merged["id"] = current.get("id") or desired.get("id") or current.get("realm")
-    for key in (
-        "realm", "enabled", "registrationAllowed", "loginWithEmailAllowed", "duplicateEmailsAllowed",
-        "ssoSessionIdleTimeout", "ssoSessionMaxLifespan", "accessTokenLifespan",
-        "accessCodeLifespan", "accessCodeLifespanUserAction", "accessCodeLifespanLogin", "groups",
-    ):
+    for key in _REALM_MERGE_KEYS:
         if key in desired:
             merged[key] = desired[key]
 
-    # Clients: by clientId, overlay desired onto existing so Keycloak-managed fields (e.g. defaultClientScopes, protocol) are preserved for local/direct grant login
-    desired_client_ids = {c.get("clientId") for c in desired.get("clients") or [] if c.get("clientId")}
-    current_clients = list(current.get("clients") or [])
-    merged_clients = [c for c in current_clients if c.get("clientId") not in desired_client_ids]
-    for d_client in desired.get("clients") or []:
-        cid = d_client.get("clientId")
-        if not cid:
-            continue
-        existing = next((c for c in current_clients if c.get("clientId") == cid), None)
-        if existing:
-            new_client = dict(existing)
-            for k, v in d_client.items():
-                new_client[k] = v
-            if existing.get("id") is not None:
-                new_client["id"] = existing["id"]
-        else:
-            new_client = dict(d_client)
-        merged_clients.append(new_client)
-    merged["clients"] = merged_clients
+    # Clients: by clientId, overlay desired onto existing so Keycloak-managed fields (e.g. defaultClientScopes, protocol) are preserved for local/direct grant login.
+    # Lists the import does not carry are left as the (aliased) current value.
+    if desired.get("clients"):
+        merged["clients"] = _merge_keyed_list(
+            current.get("clients") or [], desired["clients"], "clientId", overlay=True
+        )
 
     # Authentication flows: by alias, replace with desired and keep current id
-    desired_flow_aliases = {f.get("alias") for f in desired.get("authenticationFlows") or [] if f.get("alias")}
-    current_flows = list(current.get("authenticationFlows") or [])
-    merged_flows = [f for f in current_flows if f.get("alias") not in desired_flow_aliases]
-    for d_flow in desired.get("authenticationFlows") or []:
-        alias = d_flow.get("alias")
-        if not alias:
-            continue
-        existing = next((f for f in current_flows if f.get("alias") == alias), None)
-        new_flow = dict(d_flow)
-        if existing and existing.get("id") is not None:
-            new_flow["id"] = existing["id"]
-        merged_flows.append(new_flow)
-    merged["authenticationFlows"] = merged_flows
+    if desired.get("authenticationFlows"):
+        merged["authenticationFlows"] = _merge_keyed_list(
+            current.get("authenticationFlows") or [], desired["authenticationFlows"], "alias", overlay=False
+        )
 
     # Identity providers: GET /admin/realms/{realm} does not return them; preserve by not sending
     # (IdPs are managed separately via deploy-configure-keycloak-google-idp.py). Do not set merged["identityProviders"]
@@ -911,6 +770,54 @@ def _merge_realm(current: dict, desired: dict) -> dict:
     return merged
 
 
+def _sparse_realm_payload(desired: dict) -> dict:
+    """
+    Realm PUT body with only the keys we manage (KEYCLOAK_SPARSE_REALM_PUT=1). Client and flow
+    `id`s are dropped so Keycloak matches them by clientId / alias; nothing is copied from GET.
+    """
+    payload = {key: desired[key] for key in _REALM_MERGE_KEYS if key in desired}
+    for key in ("clients", "authenticationFlows"):
+        if desired.get(key):
+            payload[key] = [{k: v for k, v in item.items() if k != "id"} for item in desired[key]]
+    return payload
+
+
+def _realm_matches_desired(current: dict, current_clients: list[dict], desired: dict) -> bool:
+    """
+    True when PUT of _merge_realm(current, desired) would change nothing we manage, so the
+    (large) realm PUT can be skipped on converged re-runs. Top-level keys must be equal and
+    every desired client must already carry its desired fields (attributes as a subset,
+    string lists order-insensitive). Groups are skipped: realm GET omits them and they are
+    enforced via the groups API. authenticationFlows are not returned by realm GET, so
+    desired flows always force the PUT.
+    """
+    for key in _REALM_COMPARE_KEYS:
+        if key == "groups" or key not in desired:
+            continue
+        if current.get(key) != desired[key]:
+            return False
+    if desired.get("authenticationFlows"):
+        return False
+    current_by_cid = {c["clientId"]: c for c in current_clients if c.get("clientId")}
+    for d_client in desired.get("clients") or []:
+        cid = d_client.get("clientId")
+        if not cid:
+            continue
+        existing = current_by_cid.get(cid)
+        if existing is None:
+            return False
+        for k, v in d_client.items():
+            if k == "id":
+                continue
+            cur = existing.get(k)
+            if isinstance(v, dict) and isinstance(cur, dict):
+                if any(cur.get(ak) != av for ak, av in v.items()):
+                    return False
+            elif _normalize_for_compare(v) != _normalize_for_compare(cur):
+                return False
+    return True
+
+
 def _run_docker(*args: str, timeout: int = 10) -> str | None:
     try:
         out = subprocess.run(
@@ -927,30 +834,90 @@ def _run_docker(*args: str, timeout: int = 10) -> str | None:
 
 
 DOCKER_BRIDGE_GATEWAYS = [f"172.{octet}.0.1" for octet in range(16, 32)]
+_IPV4_RE = re.compile(r"^\d{1,3}(?:\.\d{1,3}){3}$")
 
 
-def _docker_container_ip_on_network(service_name: str) -> str | None:
-    """Find a container's IP by searching all kairos-related Docker networks."""
-    IP_RE = re.compile(r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$")
+_DOCKER_NETWORKS_LOCK = threading.Lock()
+
+
+def _docker_sdk_kairos_network_containers() -> tuple[dict, ...] | None:
+    """
+    Network scan over the Docker socket (docker SDK). None when the SDK or daemon is unavailable,
+    or when that daemon has no kairos networks: the SDK only reads DOCKER_HOST / the default
+    socket, while the CLI may follow a docker context (Colima, rootless), so the caller then
+    retries via the CLI.
+    """
+    if docker is None:
+        return None
+    try:
+        client = docker.from_env(timeout=10)
+        try:
+            containers: list[dict] = []
+            found = False
+            for net in client.api.networks():
+                if "kairos" not in (net.get("Name") or ""):
+                    continue
+                found = True
+                info = client.api.inspect_network(net["Id"])
+                containers.extend((info.get("Containers") or {}).values())
+            return tuple(containers) if found else None
+        finally:
+            client.close()
+    except (docker.errors.DockerException, OSError):
+        return None
+
+
+@functools.lru_cache(maxsize=1)
+def _docker_kairos_network_containers() -> tuple[dict, ...]:
+    """
+    Containers attached to kairos-related Docker networks. Network membership does not change
+    during a run, so this scans once and every realm reuses it: via the docker SDK when installed
+    (no process spawn), else one `network ls` plus one `inspect` for all networks (per network
+    if that batch fails).
+    """
+    sdk_containers = _docker_sdk_kairos_network_containers()
+    if sdk_containers is not None:
+        return sdk_containers
     out = _run_docker("network", "ls", "--format", "{{.Name}}")
     if not out:
-        return None
-    for net_name in out.splitlines():
-        if "kairos" not in net_name:
-            continue
-        cdata = _run_docker("network", "inspect", net_name, "--format", "{{json .Containers}}")
-        if not cdata:
-            continue
+        return ()
+    net_names = [n for n in out.splitlines() if "kairos" in n]
+    if not net_names:
+        return ()
+    inspect_fmt = ("--format", "{{json .Containers}}")
+    cdata = _run_docker("network", "inspect", *net_names, *inspect_fmt)
+    if cdata is None and len(net_names) > 1:
+        # A network removed between `ls` and `inspect` fails the whole batch; inspect one by one
+        # so only that network is skipped.
+        cdata = "\n".join(filter(None, (_run_docker("network", "inspect", n, *inspect_fmt) for n in net_names)))
+    if not cdata:
+        return ()
+    containers: list[dict] = []
+    for line in cdata.splitlines():
         try:
-            containers = json.loads(cdata)
+            by_id = json_loads(line)
         except json.JSONDecodeError:
             continue
-        for _cid, info in containers.items():
-            name = info.get("Name") or ""
-            if service_name in name:
-                addr = (info.get("IPv4Address") or "").split("/")[0]
-                if addr and IP_RE.match(addr):
-                    return addr
+        if isinstance(by_id, dict):
+            containers.extend(by_id.values())
+    return tuple(containers)
+
+
+def _docker_kairos_network_containers_locked() -> tuple[dict, ...]:
+    """Cached network scan; the lock makes concurrent first callers share one docker run."""
+    with _DOCKER_NETWORKS_LOCK:
+        return _docker_kairos_network_containers()
+
+
+def _docker_container_ip_on_network(service_name: str) -> str | None:
+    """Find a container's IP by searching all kairos-related Docker networks."""
+    containers = _docker_kairos_network_containers_locked()
+    for info in containers:
+        name = info.get("Name") or ""
+        if service_name in name:
+            addr = (info.get("IPv4Address") or "").split("/")[0]
+            if addr and _IPV4_RE.match(addr):
+                return addr
     return None
 
 
@@ -971,54 +938,40 @@ def get_trusted_hosts_for_env(env: str) -> list[str]:
     return base
 
 
-def get_realm_id(base_url: str, realm: str, token: str) -> str:
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            data = json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"GET realm failed: {e.code} {body}")
-    return data.get("id") or realm
-
-
 def get_components(base_url: str, realm: str, token: str, parent_id: str, typ: str) -> list[dict]:
     q = urllib.parse.urlencode({"parent": parent_id, "type": typ})
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/components?{q}"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"GET components failed: {e.code} {body}")
+    return admin_api(base_url, token, "GET", f"/admin/realms/{realm}/components?{q}", "GET components")
+
+
+# ComponentRepresentation fields Keycloak reads on PUT. `config` must be complete: keys missing
+# from it are deleted from the stored component.
+_COMPONENT_PUT_FIELDS = ("id", "name", "providerId", "providerType", "parentId", "subType")
+
+
+def _component_put_payload(comp: dict, config: dict) -> dict:
+    """Component PUT body: identity fields from GET plus the full merged config (nothing else)."""
+    payload = {k: comp[k] for k in _COMPONENT_PUT_FIELDS if comp.get(k) is not None}
+    payload["config"] = config
+    return payload
 
 
 def update_component(
     base_url: str, realm: str, component_id: str, payload: dict, token: str
 ) -> None:
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/components/{component_id}"
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="PUT")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"PUT component failed: {e.code} {body}")
+    admin_api(
+        base_url, token, "PUT", f"/admin/realms/{realm}/components/{component_id}",
+        "PUT component", payload,
+    )
+
+
+def _component_config_matches(current: dict, desired: dict) -> bool:
+    """True when every desired component config key already holds the same values (order-insensitive)."""
+    return all(sorted(current.get(k) or []) == sorted(v) for k, v in desired.items())
 
 
 def ensure_trusted_hosts(
-    base_url: str, realm: str, env: str, token: str
+    base_url: str, realm: str, env: str, token: str, components: list[dict]
 ) -> None:
-    parent_id = get_realm_id(base_url, realm, token)
-    components = get_components(
-        base_url, realm, token, parent_id, CLIENT_REGISTRATION_POLICY_TYPE
-    )
     targets = [
         c
         for c in components
@@ -1027,21 +980,27 @@ def ensure_trusted_hosts(
         and c.get("id")
     ]
     if not targets:
-        print(f"WARNING: No Trusted Hosts component in {realm}; skip.", file=sys.stderr)
+        _log(f"WARNING: No Trusted Hosts component in {realm}; skip.", file=sys.stderr)
         return
     trusted_hosts = get_trusted_hosts_for_env(env)
+    desired_cfg = {
+        "host-sending-registration-request-must-match": ["false" if env == "dev" else "true"],
+        "trusted-hosts": trusted_hosts,
+        "client-uris-must-match": ["true" if env == "dev" else "false"],
+    }
     for comp in targets:
-        config = dict(comp.get("config") or {})
-        config["host-sending-registration-request-must-match"] = ["false" if env == "dev" else "true"]
-        config["trusted-hosts"] = trusted_hosts
-        config["client-uris-must-match"] = ["true" if env == "dev" else "false"]
-        update_component(base_url, realm, comp["id"], {**comp, "config": config}, token)
+        current_cfg = comp.get("config") or {}
         sub = comp.get("subType") or "?"
-        print(f"  Trusted hosts ({sub}) {realm}: {trusted_hosts}")
+        if _component_config_matches(current_cfg, desired_cfg):
+            _log(f"  Trusted hosts ({sub}) {realm}: already up to date")
+            continue
+        config = {**current_cfg, **desired_cfg}
+        update_component(base_url, realm, comp["id"], _component_put_payload(comp, config), token)
+        _log(f"  Trusted hosts ({sub}) {realm}: {trusted_hosts}")
 
 
 def ensure_allowed_client_templates(
-    base_url: str, realm: str, token: str
+    base_url: str, realm: str, token: str, components: list[dict]
 ) -> None:
     """
     Allow named realm client scopes for dynamic OIDC client registration.
@@ -1049,10 +1008,6 @@ def ensure_allowed_client_templates(
     Requires a Client Scope named `openid` (see ensure_openid_client_scope) so mcp-remote
     and similar clients can register with OAuth scope `openid`.
     """
-    parent_id = get_realm_id(base_url, realm, token)
-    components = get_components(
-        base_url, realm, token, parent_id, CLIENT_REGISTRATION_POLICY_TYPE
-    )
     targets = [
         c
         for c in components
@@ -1060,84 +1015,63 @@ def ensure_allowed_client_templates(
         and c.get("subType") in ("anonymous", "authenticated")
     ]
     if not targets:
-        print(
+        _log(
             f"WARNING: No Allowed Client Scopes (allowed-client-templates) in {realm}; skip.",
             file=sys.stderr,
         )
         return
     allowed = list(DYNAMIC_REGISTRATION_ALLOWED_CLIENT_SCOPES)
+    desired_cfg = {
+        "allow-default-scopes": ["true"],
+        "allowed-client-scopes": allowed,
+    }
     for comp in targets:
-        config = dict(comp.get("config") or {})
-        config["allow-default-scopes"] = ["true"]
-        config["allowed-client-scopes"] = allowed
-        update_component(base_url, realm, comp["id"], {**comp, "config": config}, token)
+        current_cfg = comp.get("config") or {}
         sub = comp.get("subType") or "?"
-        print(f"  Allowed client templates ({sub}) {realm}: {allowed}")
+        if _component_config_matches(current_cfg, desired_cfg):
+            _log(f"  Allowed client templates ({sub}) {realm}: already up to date")
+            continue
+        config = {**current_cfg, **desired_cfg}
+        update_component(base_url, realm, comp["id"], _component_put_payload(comp, config), token)
+        _log(f"  Allowed client templates ({sub}) {realm}: {allowed}")
 
 
 def get_user_id(base_url: str, realm: str, username: str, token: str) -> str | None:
     q = urllib.parse.urlencode({"username": username})
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/users?{q}"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            users = json.loads(resp.read().decode())
-            if users:
-                return users[0].get("id")
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Get user failed: {e.code} {body}")
+    users = admin_api(base_url, token, "GET", f"/admin/realms/{realm}/users?{q}", "Get user")
+    if users:
+        return users[0].get("id")
     return None
 
 
 def create_user(base_url: str, realm: str, username: str, token: str) -> str | None:
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/users"
     email = username if "@" in username else f"{username}@localhost"
-    payload = json.dumps(
-        {
-            "username": username,
-            "enabled": True,
-            "firstName": "Kairos",
-            "lastName": "Tester",
-            "email": email,
-            "emailVerified": True,
-            "requiredActions": [],
-        }
-    ).encode("utf-8")
-    req = urllib.request.Request(url, data=payload, method="POST")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
     try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            location = resp.headers.get("Location")
-            if location:
-                return location.rstrip("/").split("/")[-1]
-            return None
-    except urllib.error.HTTPError as e:
-        if e.code == 409:
-            return None
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Create user failed: {e.code} {body}")
+        return admin_create(
+            base_url, token, f"/admin/realms/{realm}/users", "Create user",
+            {
+                "username": username,
+                "enabled": True,
+                "firstName": "Kairos",
+                "lastName": "Tester",
+                "email": email,
+                "emailVerified": True,
+                "requiredActions": [],
+            },
+            allow=(409,),
+        )
+    except urllib.error.HTTPError:
+        return None
 
 
 def set_password(
     base_url: str, realm: str, user_id: str, password: str, token: str
 ) -> None:
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/users/{user_id}/reset-password"
-    payload = json.dumps({
-        "type": "password",
-        "value": password,
-        "temporary": False,
-    }).encode("utf-8")
-    req = urllib.request.Request(url, data=payload, method="PUT")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Set password failed: {e.code} {body}")
+    admin_api(
+        base_url, token, "PUT", f"/admin/realms/{realm}/users/{user_id}/reset-password",
+        "Set password",
+        {"type": "password", "value": password, "temporary": False},
+    )
 
 
 def finalize_test_user_for_direct_grant(
@@ -1148,15 +1082,8 @@ def finalize_test_user_for_direct_grant(
     lacks first/last name, verified email, or has required actions (Update password, Verify email,
     etc.). Aligns test users with Keycloak 24+ expectations (see keycloak/keycloak#36108).
     """
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/users/{user_id}"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            user = json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Get user {user_id} failed: {e.code} {body}")
+    path = f"/admin/realms/{realm}/users/{user_id}"
+    user = admin_api(base_url, token, "GET", path, f"Get user {user_id}")
     rest = {k: v for k, v in user.items() if k != "credentials"}
     fn = (rest.get("firstName") or "").strip()
     ln = (rest.get("lastName") or "").strip()
@@ -1167,15 +1094,7 @@ def finalize_test_user_for_direct_grant(
     rest["emailVerified"] = True
     rest["enabled"] = True
     rest["requiredActions"] = []
-    payload = json.dumps(rest).encode("utf-8")
-    put_req = urllib.request.Request(url, data=payload, method="PUT")
-    put_req.add_header("Authorization", f"Bearer {token}")
-    put_req.add_header("Content-Type", "application/json")
-    try:
-        urllib.request.urlopen(put_req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Finalize test user {username!r} failed: {e.code} {body}")
+    admin_api(base_url, token, "PUT", path, f"Finalize test user {username!r}", rest)
 
 
 _KAIROS_SHARES_GROUP = "kairos-shares"
@@ -1202,19 +1121,11 @@ def list_direct_group_children(
     base_url: str, realm: str, parent_group_id: str, token: str
 ) -> list[dict]:
     q = urllib.parse.urlencode({"max": "500", "briefRepresentation": "false"})
-    url = (
-        f"{base_url.rstrip('/')}/admin/realms/{realm}/groups/"
-        f"{parent_group_id}/children?{q}"
+    raw = admin_api(
+        base_url, token, "GET", f"/admin/realms/{realm}/groups/{parent_group_id}/children?{q}",
+        f"GET group children {realm} parent={parent_group_id}",
     )
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            raw = json.loads(resp.read().decode())
-            return raw if isinstance(raw, list) else []
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"GET group children {realm} parent={parent_group_id} failed: {e.code} {body}")
+    return raw if isinstance(raw, list) else []
 
 
 def get_realm_group_id_by_name(
@@ -1223,56 +1134,40 @@ def get_realm_group_id_by_name(
     # Top-level GET often omits subGroups unless search/q is used; recurse when present,
     # and resolve nested kairos-operator under kairos-shares via /children.
     q = urllib.parse.urlencode({"briefRepresentation": "false", "max": "1000"})
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/groups?{q}"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            raw = json.loads(resp.read().decode())
-            if not isinstance(raw, list):
-                return None
-            found = _find_group_id_by_name(raw, group_name)
-            if found:
-                return found
-            if group_name == _KAIROS_OPERATOR_GROUP:
-                shares_id = _find_group_id_by_name(raw, _KAIROS_SHARES_GROUP)
-                if shares_id:
-                    for ch in list_direct_group_children(
-                        base_url, realm, shares_id, token
-                    ):
-                        if ch.get("name") == _KAIROS_OPERATOR_GROUP:
-                            cid = ch.get("id")
-                            if isinstance(cid, str) and cid:
-                                return cid
-            if group_name == _CI_TEST_SUBGROUP:
-                shared_id = _find_group_id_by_name(raw, _SHARED_GROUP)
-                if shared_id:
-                    for ch in list_direct_group_children(
-                        base_url, realm, shared_id, token
-                    ):
-                        if ch.get("name") == _CI_TEST_SUBGROUP:
-                            cid = ch.get("id")
-                            if isinstance(cid, str) and cid:
-                                return cid
-            return None
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"GET groups {realm} failed: {e.code} {body}")
+    raw = admin_api(base_url, token, "GET", f"/admin/realms/{realm}/groups?{q}", f"GET groups {realm}")
+    if not isinstance(raw, list):
+        return None
+    found = _find_group_id_by_name(raw, group_name)
+    if found:
+        return found
+    if group_name == _KAIROS_OPERATOR_GROUP:
+        shares_id = _find_group_id_by_name(raw, _KAIROS_SHARES_GROUP)
+        if shares_id:
+            for ch in list_direct_group_children(
+                base_url, realm, shares_id, token
+            ):
+                if ch.get("name") == _KAIROS_OPERATOR_GROUP:
+                    cid = ch.get("id")
+                    if isinstance(cid, str) and cid:
+                        return cid
+    if group_name == _CI_TEST_SUBGROUP:
+        shared_id = _find_group_id_by_name(raw, _SHARED_GROUP)
+        if shared_id:
+            for ch in list_direct_group_children(
+                base_url, realm, shared_id, token
+            ):
+                if ch.get("name") == _CI_TEST_SUBGROUP:
+                    cid = ch.get("id")
+                    if isinstance(cid, str) and cid:
+                        return cid
+    return None
 
 
 def fetch_realm_groups_tree(base_url: str, realm: str, token: str) -> list[dict]:
     """Full top-level group tree (includes subGroups) for Admin API moves."""
     q = urllib.parse.urlencode({"briefRepresentation": "false", "max": "1000"})
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/groups?{q}"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            raw = json.loads(resp.read().decode())
-            return raw if isinstance(raw, list) else []
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"GET groups tree {realm} failed: {e.code} {body}")
+    raw = admin_api(base_url, token, "GET", f"/admin/realms/{realm}/groups?{q}", f"GET groups tree {realm}")
+    return raw if isinstance(raw, list) else []
 
 
 def _operator_is_child_of_shares(
@@ -1296,29 +1191,17 @@ def create_top_level_group_if_missing(
     existing = get_realm_group_id_by_name(base_url, realm, name, token)
     if existing:
         return existing
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/groups"
-    payload = json.dumps({"name": name}).encode("utf-8")
-    req = urllib.request.Request(url, data=payload, method="POST")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
+    error = f"POST top-level group {name!r} {realm}"
     try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            loc = resp.headers.get("Location")
-            if loc:
-                return loc.rstrip("/").split("/")[-1]
-            body = resp.read().decode()
-            if body.strip():
-                data = json.loads(body)
-                gid = data.get("id")
-                if isinstance(gid, str) and gid:
-                    return gid
+        gid = admin_create(base_url, token, f"/admin/realms/{realm}/groups", error, {"name": name}, allow=(409,))
     except urllib.error.HTTPError as e:
+        gid = get_realm_group_id_by_name(base_url, realm, name, token)
+        if gid:
+            return gid
         body = e.read().decode() if e.fp else ""
-        if e.code == 409:
-            gid = get_realm_group_id_by_name(base_url, realm, name, token)
-            if gid:
-                return gid
-        sys.exit(f"POST top-level group {name!r} {realm} failed: {e.code} {body}")
+        sys.exit(f"{error} failed: {e.code} {body}")
+    if gid:
+        return gid
     sys.exit(f"POST top-level group {name!r} {realm}: no id in response")
 
 
@@ -1334,28 +1217,19 @@ def post_group_child(
     Create child under parent, or attach existing group (sets parent). Keycloak:
     POST /admin/realms/{realm}/groups/{parent_id}/children
     """
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/groups/{parent_id}/children"
     body: dict[str, str] = {"name": child_name}
     if existing_child_id:
         body["id"] = existing_child_id
-    payload = json.dumps(body).encode("utf-8")
-    req = urllib.request.Request(url, data=payload, method="POST")
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        err_body = e.read().decode() if e.fp else ""
-        sys.exit(
-            f"POST group child {child_name!r} under parent {parent_id!r} {realm} failed: "
-            f"{e.code} {err_body}"
-        )
+    admin_api(
+        base_url, token, "POST", f"/admin/realms/{realm}/groups/{parent_id}/children",
+        f"POST group child {child_name!r} under parent {parent_id!r} {realm}", body,
+    )
 
 
 def ensure_kairos_shares_operator_hierarchy(base_url: str, realm: str, token: str) -> None:
     """Nest kairos-operator under kairos-shares (idempotent). Realm JSON alone is insufficient."""
     if _operator_is_child_of_shares(base_url, realm, token):
-        print(
+        _log(
             f"  Groups {realm}: {_KAIROS_OPERATOR_GROUP!r} already under {_KAIROS_SHARES_GROUP!r}"
         )
         return
@@ -1372,7 +1246,7 @@ def ensure_kairos_shares_operator_hierarchy(base_url: str, realm: str, token: st
             f"{realm}: expected {_KAIROS_OPERATOR_GROUP!r} under {_KAIROS_SHARES_GROUP!r} "
             "after Admin API child POST; re-check Keycloak state."
         )
-    print(
+    _log(
         f"  Groups {realm}: nested {_KAIROS_OPERATOR_GROUP!r} under {_KAIROS_SHARES_GROUP!r}"
     )
 
@@ -1392,7 +1266,7 @@ def ensure_shared_ci_test_hierarchy(base_url: str, realm: str, token: str) -> No
     Nest ci-test under shared (idempotent). JWT group path /shared/ci-test (full.path mapper).
     """
     if _ci_test_is_child_of_shared(base_url, realm, token):
-        print(f"  Groups {realm}: '/shared/{_CI_TEST_SUBGROUP}' already present")
+        _log(f"  Groups {realm}: '/shared/{_CI_TEST_SUBGROUP}' already present")
         return
     shared_id = create_top_level_group_if_missing(base_url, realm, _SHARED_GROUP, token)
     tree = fetch_realm_groups_tree(base_url, realm, token)
@@ -1403,7 +1277,7 @@ def ensure_shared_ci_test_hierarchy(base_url: str, realm: str, token: str) -> No
             f"{realm}: expected {_CI_TEST_SUBGROUP!r} under {_SHARED_GROUP!r} "
             "after Admin API child POST; re-check Keycloak state."
         )
-    print(f"  Groups {realm}: nested {_CI_TEST_SUBGROUP!r} under {_SHARED_GROUP!r}")
+    _log(f"  Groups {realm}: nested {_CI_TEST_SUBGROUP!r} under {_SHARED_GROUP!r}")
 
 
 def ensure_top_level_groups_from_import(
@@ -1423,7 +1297,7 @@ def ensure_top_level_groups_from_import(
         wanted.append(name)
         create_top_level_group_if_missing(base_url, realm, name, token)
     if wanted:
-        print(f"  Groups {realm}: ensured top-level {sorted(set(wanted))}")
+        _log(f"  Groups {realm}: ensured top-level {sorted(set(wanted))}")
 
 
 def ensure_shared_group(base_url: str, realm: str, token: str) -> None:
@@ -1432,7 +1306,7 @@ def ensure_shared_group(base_url: str, realm: str, token: str) -> None:
     This is the canonical allowlist prefix for app-side OIDC group filtering.
     """
     create_top_level_group_if_missing(base_url, realm, _SHARED_GROUP, token)
-    print(f"  Groups {realm}: ensured '/{_SHARED_GROUP}'")
+    _log(f"  Groups {realm}: ensured '/{_SHARED_GROUP}'")
 
 
 def import_includes_top_level_group(desired_realm: dict, name: str) -> bool:
@@ -1445,14 +1319,10 @@ def import_includes_top_level_group(desired_realm: dict, name: str) -> bool:
 def delete_realm_group_by_id(
     base_url: str, realm: str, group_id: str, token: str
 ) -> None:
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/groups/{group_id}"
-    req = urllib.request.Request(url, method="DELETE")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"DELETE group id={group_id!r} {realm} failed: {e.code} {body}")
+    admin_api(
+        base_url, token, "DELETE", f"/admin/realms/{realm}/groups/{group_id}",
+        f"DELETE group id={group_id!r} {realm}",
+    )
 
 
 def prune_top_level_groups_not_in_import(
@@ -1473,20 +1343,15 @@ def prune_top_level_groups_not_in_import(
             continue
         if name not in wanted:
             delete_realm_group_by_id(base_url, realm, gid, token)
-            print(f"  Groups {realm}: removed top-level group not in import ({name!r})")
+            _log(f"  Groups {realm}: removed top-level group not in import ({name!r})")
 
 
 def list_user_groups(base_url: str, realm: str, user_id: str, token: str) -> list[dict]:
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/users/{user_id}/groups"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            raw = json.loads(resp.read().decode())
-            return raw if isinstance(raw, list) else []
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"GET user groups {realm} user={user_id} failed: {e.code} {body}")
+    raw = admin_api(
+        base_url, token, "GET", f"/admin/realms/{realm}/users/{user_id}/groups",
+        f"GET user groups {realm} user={user_id}",
+    )
+    return raw if isinstance(raw, list) else []
 
 
 def user_is_in_named_group(groups: list[dict], group_name: str) -> bool:
@@ -1503,14 +1368,10 @@ def ensure_user_in_group(
     base_url: str, realm: str, user_id: str, group_id: str, token: str
 ) -> None:
     """Idempotent: PUT membership (Keycloak accepts repeat)."""
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm}/users/{user_id}/groups/{group_id}"
-    req = urllib.request.Request(url, method="PUT")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        urllib.request.urlopen(req, timeout=15)
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"Add user to group failed: {e.code} {body}")
+    admin_api(
+        base_url, token, "PUT", f"/admin/realms/{realm}/users/{user_id}/groups/{group_id}",
+        "Add user to group",
+    )
 
 
 def ensure_test_user_in_group(
@@ -1537,7 +1398,7 @@ def ensure_test_user_in_group(
             f"Keycloak Admin API did not report {username!r} in {group_name!r} after PUT "
             f"(user groups: {[g.get('name') for g in assigned]!r})."
         )
-    print(f"  Test user {realm}: {username} -> group {group_name} (verified)")
+    _log(f"  Test user {realm}: {username} -> group {group_name} (verified)")
 
 
 def ensure_test_user(
@@ -1547,19 +1408,15 @@ def ensure_test_user(
     if not user_id:
         user_id = create_user(base_url, realm, username, token)
     if not user_id:
-        print(f"WARNING: Could not create/find user {username} in {realm}.", file=sys.stderr)
+        _log(f"WARNING: Could not create/find user {username} in {realm}.", file=sys.stderr)
         return
     set_password(base_url, realm, user_id, password, token)
     finalize_test_user_for_direct_grant(base_url, realm, user_id, username, token)
-    print(f"  Test user {realm}: {username}")
+    _log(f"  Test user {realm}: {username}")
 
 
-# Realm keys we set from import (must match _merge_realm and import JSON)
-_REALM_COMPARE_KEYS = (
-    "realm", "enabled", "registrationAllowed", "loginWithEmailAllowed", "duplicateEmailsAllowed",
-    "ssoSessionIdleTimeout", "ssoSessionMaxLifespan", "accessTokenLifespan",
-    "accessCodeLifespan", "accessCodeLifespanUserAction", "accessCodeLifespanLogin", "groups",
-)
+# Realm keys we set from import (same set _merge_realm applies)
+_REALM_COMPARE_KEYS = _REALM_MERGE_KEYS
 # Client keys we set from import (subset of ClientRepresentation)
 _CLIENT_COMPARE_KEYS = (
     "clientId", "name", "enabled", "publicClient", "standardFlowEnabled", "directAccessGrantsEnabled",
@@ -1571,16 +1428,11 @@ _VERIFY_CLIENT_IDS = frozenset({"kairos-cli"})
 
 def get_realm_groups(base_url: str, realm_name: str, token: str) -> list[dict]:
     """GET realm groups (names only for compare). Keycloak realm GET may not include groups."""
-    url = f"{base_url.rstrip('/')}/admin/realms/{realm_name}/groups?briefRepresentation=true"
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            groups = json.loads(resp.read().decode())
-            return [{"name": g.get("name", "")} for g in groups]
-    except urllib.error.HTTPError as e:
-        body = e.read().decode() if e.fp else ""
-        sys.exit(f"GET groups {realm_name} failed: {e.code} {body}")
+    groups = admin_api(
+        base_url, token, "GET", f"/admin/realms/{realm_name}/groups?briefRepresentation=true",
+        f"GET groups {realm_name}",
+    )
+    return [{"name": g.get("name", "")} for g in groups]
 
 
 def _dump_realm_for_compare(base_url: str, realm_name: str, token: str) -> dict:
@@ -1683,120 +1535,157 @@ def verify_realms_after_update(base_url: str, token: str, import_dir: Path, env:
     return all_diffs
 
 
-def main() -> int:
-    root = Path(__file__).resolve().parent.parent
-    env = get_env(root)
-    base_url = env.get("KEYCLOAK_URL", "http://localhost:8080")
-    admin_password = env.get("KEYCLOAK_ADMIN_PASSWORD")
-    if not admin_password:
-        sys.exit("KEYCLOAK_ADMIN_PASSWORD not set. Set in .env or export.")
-
-    test_username = env.get("TEST_USERNAME", "kairos-tester")
-    test_password = env.get("TEST_PASSWORD", "kairos-tester-secret")
-    ci_test_only_username = env.get("KAIROS_CI_TEST_USERNAME", "kairos-ci-tester")
-    ci_test_only_password = env.get("KAIROS_CI_TEST_PASSWORD", "kairos-ci-tester-secret")
-
-    token = get_admin_token(base_url, admin_password)
-    import_dir = root / "scripts" / "keycloak" / "import"
-    desired_by_realm: dict[str, dict] = {}
-
+def configure_realm(
+    base_url: str,
+    token: str,
+    import_dir: Path,
+    env: dict,
+    realm_name: str,
+    filename: str,
+) -> dict | None:
+    """
+    Steps 1–4b for one realm; returns the desired realm JSON (None when the import file is
+    missing). Realms share no state here, so main() runs one worker per realm.
+    """
     # 1. Ensure realm exists (minimal create), then always apply config from file (idempotent)
-    existing = list_realms(base_url, token)
-    for realm_name, filename in REALM_FILES:
-        path = import_dir / filename
-        if not path.is_file():
-            print(f"Realm file not found: {path}, skip.", file=sys.stderr)
-            continue
-        if realm_name not in existing:
-            create_realm_minimal(base_url, token, realm_name)
-            print(f"Created realm {realm_name} (defaults).")
+    path = import_dir / filename
+    if not path.is_file():
+        _log(f"Realm file not found: {path}, skip.", file=sys.stderr)
+        return None
+    current = find_realm_full(base_url, realm_name, token)
+    if current is None:
+        create_realm_minimal(base_url, token, realm_name)
+        _log(f"Created realm {realm_name} (defaults).")
         current = get_realm_full(base_url, realm_name, token)
-        desired = load_desired_realm(path, env, realm_name)
-        desired_by_realm[realm_name] = desired
-        merged = _merge_realm(current, desired)
-        update_realm(base_url, realm_name, merged, token)
-        print(f"Updated realm {realm_name}.")
-        # Keycloak realm PUT does not create new clients; create any missing via POST
+    # Component parent for client-registration policies (steps 2 and 4); the id never changes.
+    realm_id = current.get("id") or realm_name
+    current_clients = get_realm_clients(base_url, realm_name, token)
+    desired = load_desired_realm(path, env, realm_name)
+    if _realm_matches_desired(current, current_clients, desired):
+        _log(f"Realm {realm_name} already in desired state.")
+        existing_ids = {c["clientId"] for c in current_clients if c.get("clientId")}
+    else:
+        if env.get("KEYCLOAK_SPARSE_REALM_PUT") == "1":
+            payload = _sparse_realm_payload(desired)
+        else:
+            payload = _merge_realm(current, desired)
+        update_realm(base_url, realm_name, payload, token)
+        _log(f"Updated realm {realm_name}.")
         existing_ids = list_realm_client_ids(base_url, realm_name, token)
-        for d_client in desired.get("clients") or []:
-            cid = d_client.get("clientId")
-            if not cid or cid in existing_ids:
-                continue
-            create_realm_client(base_url, realm_name, d_client, token)
-            print(f"  Created client {cid} in {realm_name}.")
-            existing_ids.add(cid)
+    # Keycloak realm PUT does not create new clients; create any missing via POST
+    for d_client in desired.get("clients") or []:
+        cid = d_client.get("clientId")
+        if not cid or cid in existing_ids:
+            continue
+        create_realm_client(base_url, realm_name, d_client, token)
+        _log(f"  Created client {cid} in {realm_name}.")
+        existing_ids.add(cid)
 
-        push_kairos_mcp_redirect_config(base_url, realm_name, desired, token)
+    push_kairos_mcp_redirect_config(base_url, realm_name, desired, token)
 
     # 1b. Realm PUT does not reliably create/move groups; enforce import top-level groups
     # and then /shared plus optional shares/operator hierarchy via Admin API.
-    for realm_name, _ in REALM_FILES:
-        desired = desired_by_realm.get(realm_name, {})
-        ensure_top_level_groups_from_import(base_url, realm_name, desired, token)
-        ensure_shared_group(base_url, realm_name, token)
-        ensure_shared_ci_test_hierarchy(base_url, realm_name, token)
-        if import_includes_top_level_group(desired, _KAIROS_SHARES_GROUP):
-            ensure_kairos_shares_operator_hierarchy(base_url, realm_name, token)
-        prune_top_level_groups_not_in_import(base_url, realm_name, desired, token)
-
-    # 2. Set trusted hosts per realm (dev / prod)
-    for realm_name, _ in REALM_FILES:
-        env_key = realm_name.replace("kairos-", "")
-        ensure_trusted_hosts(base_url, realm_name, env_key, token)
+    ensure_top_level_groups_from_import(base_url, realm_name, desired, token)
+    ensure_shared_group(base_url, realm_name, token)
+    ensure_shared_ci_test_hierarchy(base_url, realm_name, token)
+    if import_includes_top_level_group(desired, _KAIROS_SHARES_GROUP):
+        ensure_kairos_shares_operator_hierarchy(base_url, realm_name, token)
+    prune_top_level_groups_not_in_import(base_url, realm_name, desired, token)
+
+    # 2. Set trusted hosts (dev / prod). Steps 2 and 4 update disjoint client-registration
+    #    policy components (trusted-hosts / allowed-client-templates), so one listing serves both.
+    policies = get_components(base_url, realm_name, token, realm_id, CLIENT_REGISTRATION_POLICY_TYPE)
+    ensure_trusted_hosts(base_url, realm_name, realm_name.replace("kairos-", ""), token, policies)
 
     # 3. Client Scope `openid` as realm **default** (not optional) so Userinfo works for
     #    Bearer tokens. Without `openid` in scope, Keycloak returns 403 "Missing openid scope"
     #    on the Userinfo endpoint, breaking the groups-fallback in bearer-validate.ts.
-    openid_scope_ids: dict[str, str] = {}
-    for realm_name, _ in REALM_FILES:
-        openid_scope_ids[realm_name] = ensure_openid_client_scope(base_url, realm_name, token)
+    openid_id = ensure_openid_client_scope(base_url, realm_name, token)
 
     # 3b. Shared groups client scope (default for all clients, including dynamic registration).
-    group_scope_ids: dict[str, str] = {}
-    for realm_name, _ in REALM_FILES:
-        group_scope_ids[realm_name] = ensure_kairos_groups_client_scope(base_url, realm_name, token)
+    scope_id = ensure_kairos_groups_client_scope(base_url, realm_name, token)
 
     # 4. Dynamic client registration: allowed client-scope templates
-    for realm_name, _ in REALM_FILES:
-        ensure_allowed_client_templates(base_url, realm_name, token)
+    ensure_allowed_client_templates(base_url, realm_name, token, policies)
 
     # 4b. Attach groups + openid scopes to realm defaults + named clients (kairos-mcp / kairos-cli).
     #     Realm defaults apply to newly registered DCR clients automatically. Named clients
     #     need explicit linking because they were created before the scopes became defaults.
-    for realm_name, _ in REALM_FILES:
-        scope_id = group_scope_ids.get(realm_name)
-        if not scope_id:
-            sys.exit(f"Missing {KAIROS_GROUPS_CLIENT_SCOPE_NAME} scope id for {realm_name}")
-        openid_id = openid_scope_ids.get(realm_name)
-        ensure_default_client_scope(
-            base_url, realm_name, token, scope_id, KAIROS_GROUPS_CLIENT_SCOPE_NAME
+    ensure_default_client_scope(
+        base_url, realm_name, token, scope_id, KAIROS_GROUPS_CLIENT_SCOPE_NAME
+    )
+    for cid in sorted(CLIENT_IDS_FOR_GROUP_MAPPER):
+        c_uuid = get_client_internal_id_by_client_id(base_url, realm_name, cid, token)
+        if not c_uuid:
+            _log(
+                f"WARNING: client {cid!r} missing in {realm_name}; skip scope links.",
+                file=sys.stderr,
+            )
+            continue
+        ensure_client_default_scope(
+            base_url, realm_name, token, c_uuid, scope_id, KAIROS_GROUPS_CLIENT_SCOPE_NAME
         )
-        for cid in sorted(CLIENT_IDS_FOR_GROUP_MAPPER):
-            c_uuid = get_client_internal_id_by_client_id(base_url, realm_name, cid, token)
-            if not c_uuid:
-                print(
-                    f"WARNING: client {cid!r} missing in {realm_name}; skip scope links.",
-                    file=sys.stderr,
-                )
-                continue
+        if openid_id:
             ensure_client_default_scope(
-                base_url, realm_name, token, c_uuid, scope_id, KAIROS_GROUPS_CLIENT_SCOPE_NAME
+                base_url, realm_name, token, c_uuid, openid_id, "openid"
             )
-            if openid_id:
-                ensure_client_default_scope(
-                    base_url, realm_name, token, c_uuid, openid_id, "openid"
-                )
-            remove_kairos_oidc_group_mapper_from_client(base_url, realm_name, c_uuid, cid, token)
-            # Optional scopes (profile, email, offline_access) — available when requested.
-            realm_scopes = list_realm_client_scopes(base_url, realm_name, token)
-            for opt_name in CLIENT_OPTIONAL_SCOPES:
-                opt_row = next((s for s in realm_scopes if s.get("name") == opt_name), None)
-                if not opt_row:
-                    print(f"  WARNING: realm scope {opt_name!r} missing in {realm_name}; skip.", file=sys.stderr)
-                    continue
-                ensure_client_optional_scope(
-                    base_url, realm_name, token, c_uuid, opt_row["id"], opt_name
-                )
+        remove_kairos_oidc_group_mapper_from_client(base_url, realm_name, c_uuid, cid, token)
+        # Optional scopes (profile, email, offline_access) — available when requested.
+        realm_scopes = list_realm_client_scopes(base_url, realm_name, token)
+        for opt_name in CLIENT_OPTIONAL_SCOPES:
+            opt_row = next((s for s in realm_scopes if s.get("name") == opt_name), None)
+            if not opt_row:
+                _log(f"  WARNING: realm scope {opt_name!r} missing in {realm_name}; skip.", file=sys.stderr)
+                continue
+            ensure_client_optional_scope(
+                base_url, realm_name, token, c_uuid, opt_row["id"], opt_name
+            )
+    return desired
+
+
+def main() -> int:
+    root = Path(__file__).resolve().parent.parent
+    env = get_env(root)
+    base_url = env.get("KEYCLOAK_URL", "http://localhost:8080").rstrip("/")
+    admin_password = env.get("KEYCLOAK_ADMIN_PASSWORD")
+    if not admin_password:
+        sys.exit("KEYCLOAK_ADMIN_PASSWORD not set. Set in .env or export.")
+
+    test_username = env.get("TEST_USERNAME", "kairos-tester")
+    test_password = env.get("TEST_PASSWORD", "kairos-tester-secret")
+    ci_test_only_username = env.get("KAIROS_CI_TEST_USERNAME", "kairos-ci-tester")
+    ci_test_only_password = env.get("KAIROS_CI_TEST_PASSWORD", "kairos-ci-tester-secret")
+
+    import_dir = root / "scripts" / "keycloak" / "import"
+    desired_by_realm: dict[str, dict] = {}
+
+    # 1–4b. Per-realm configuration; realms are independent, so overlap their Admin API
+    # round-trips. Collect every failure before exiting so partial results stay visible.
+    # The Docker network scan (trusted hosts, step 2) does not need Keycloak; start it while
+    # the admin token is fetched so the per-realm workers hit the warm cache.
+    failures: list[str] = []
+    with ThreadPoolExecutor(max_workers=len(REALM_FILES) + 1) as pool:
+        pool.submit(_docker_kairos_network_containers_locked)
+        token = get_admin_token(base_url, admin_password)
+        futures = [
+            (realm_name, pool.submit(configure_realm, base_url, token, import_dir, env, realm_name, filename))
+            for realm_name, filename in REALM_FILES
+        ]
+        for realm_name, future in futures:
+            try:
+                desired = future.result()
+            except SystemExit as e:
+                failures.append(f"{realm_name}: {e.code}")
+                continue
+            except Exception as e:  # e.g. URLError when Keycloak is unreachable or times out
+                failures.append(f"{realm_name}: {type(e).__name__}: {e}")
+                continue
+            if desired is not None:
+                desired_by_realm[realm_name] = desired
+    if failures:
+        for msg in failures:
+            _log(msg, file=sys.stderr)
+        sys.exit(1)
 
     # 5. Test users in dev only (password); group membership runs after verify (step 7)
     for realm_name in ("kairos-dev",):
@@ -1806,11 +1695,11 @@ def main() -> int:
     # 6. Verify: dump from Keycloak and compare with import
     verify_errors = verify_realms_after_update(base_url, token, import_dir, env)
     if verify_errors:
-        print("Verification failed (dump vs import):", file=sys.stderr)
+        _log("Verification failed (dump vs import):", file=sys.stderr)
         for msg in verify_errors:
-            print(f"  - {msg}", file=sys.stderr)
+            _log(f"  - {msg}", file=sys.stderr)
         sys.exit(1)
-    print("Verified: dump matches import.")
+    _log("Verified: dump matches import.")
 
     # 7. Test user groups last (realm/clients verified); GET confirms membership for Admin UI / tokens
     for realm_name in ("kairos-dev",):
@@ -1823,7 +1712,7 @@ def main() -> int:
         ensure_test_user_in_group(base_url, realm_name, test_username, "ci-test", token)
         ensure_test_user_in_group(base_url, realm_name, ci_test_only_username, "ci-test", token)
 
-    print("Keycloak realms configured.")
+    _log("Keycloak realms configured.")
     return 0
 
 
@@ -13,10 +13,12 @@ Usage:
 from __future__ import annotations
 
 import argparse
+import base64
 import os
 import re
-import secrets
 import sys
+import tempfile
+from collections.abc import Iterator
 from pathlib import Path
 
 
@@ -35,94 +37,154 @@ SECRET_KEYS = [
 
 KV_URL_KEYS = ("KEY_VALUE_STORE_URL", "REDIS_URL")
 
+# Keys that must be non-empty in .env (ordered, so error messages are stable).
+REQUIRED_KEYS = (*SECRET_KEYS, "QDRANT_URL", "QDRANT_COLLECTION")
+# Everything missing_required reads; --verify keeps only these from .env.
+VERIFY_KEYS = frozenset((*REQUIRED_KEYS, *KV_URL_KEYS))
+
+# Secrets generated when missing: (encoding, random bytes). "urlsafe" matches
+# secrets.token_urlsafe(24) (32 chars), "hex" matches secrets.token_hex(32) (64 chars).
+GENERATED_SECRETS = {
+    "KEYCLOAK_ADMIN_PASSWORD": ("urlsafe", 24),
+    "KEYCLOAK_DB_PASSWORD": ("urlsafe", 24),
+    "REDIS_PASSWORD": ("urlsafe", 24),
+    "QDRANT_API_KEY": ("urlsafe", 24),
+    "SESSION_SECRET": ("hex", 32),
+}
+
 # Dev defaults applied when generating .env (merged after template; template can override).
 DEV_DEFAULTS = {
     "MAX_CONCURRENT_MCP_REQUESTS": "10000",
 }
 
-PLACEHOLDER_RE = re.compile(r"^__([A-Za-z_][A-Za-z0-9_]*)__$")
 PLACEHOLDER_INLINE_RE = re.compile(r"__([A-Za-z_][A-Za-z0-9_]*)__")
 
 
-def is_placeholder(value: str) -> bool:
-    return bool(value and PLACEHOLDER_RE.match(value.strip()))
+def placeholder_name(value: str) -> str | None:
+    """NAME if value is exactly __NAME__ (NAME an ASCII identifier), else None. No strip."""
+    if not (value.startswith("__") and value.endswith("__")):
+        return None
+    name = value[2:-2]
+    return name if name.isascii() and name.isidentifier() else None
 
 
 def parse_env_file(path: Path) -> dict[str, str]:
     """Parse KEY=value lines; skip comments and empty. Returns dict key -> value."""
-    out: dict[str, str] = {}
-    if not path.exists():
-        return out
-    for line in path.read_text().splitlines():
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        m = re.match(r"^([A-Za-z_][A-Za-z0-9_]*)=(.*)$", line)
-        if m:
-            out[m.group(1)] = m.group(2)
-    return out
+    try:
+        return dict(_iter_env_pairs(str(path)))
+    except FileNotFoundError:
+        return {}
 
 
-def read_env_lines(path: Path) -> list[str]:
-    """Read file as lines (preserve order and comments)."""
-    if not path.exists():
-        return []
-    return path.read_text().splitlines()
+def _iter_env_pairs(path: str) -> Iterator[tuple[str, str]]:
+    """Yield (key, value) per KEY=value line, streaming the file."""
+    # UTF-8 explicitly, matching write_env_file, rather than the locale encoding.
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            key, sep, value = line.strip().partition("=")
+            # ASCII identifier == [A-Za-z_][A-Za-z0-9_]*; comment and blank lines never qualify.
+            if sep and key.isascii() and key.isidentifier():
+                yield key, value
+
+
+def collect_env_keys(path: Path, keys: frozenset[str]) -> dict[str, str]:
+    """
+    Only `keys` from an env file, without building the full dict. Reads to the end:
+    a later KEY= line overrides an earlier one, as in parse_env_file and docker compose.
+    """
+    return {k: v for k, v in _iter_env_pairs(str(path)) if k in keys}
 
 
 def write_env_file(path: Path, data: dict[str, str], key_order: list[str] | None = None) -> None:
-    """Write KEY=value file. If key_order given, output in that order; else sorted."""
+    """
+    Write KEY=value file. If key_order given, output in that order; else sorted.
+    Atomic: a 0600 temp file in the same directory is fsynced and renamed over `path`, so
+    a crash never leaves a half-written .env (and secrets are not world-readable).
+    """
     path.parent.mkdir(parents=True, exist_ok=True)
     if key_order:
-        items = [(k, data[k]) for k in key_order if k in data]
-        for k in sorted(data):
-            if k not in {x[0] for x in items}:
-                items.append((k, data[k]))
+        # dict.fromkeys dedups in order, so a repeated key in key_order is written once.
+        ordered = dict.fromkeys(k for k in key_order if k in data)
+        items = [(k, data[k]) for k in ordered]
+        items.extend((k, data[k]) for k in sorted(k for k in data if k not in ordered))
     else:
         items = sorted(data.items())
-    lines = [f"{k}={v}" for k, v in items]
-    path.write_text("\n".join(lines) + "\n")
-
-
-def resolve_secrets(keys: list[str], existing: dict[str, str], force: bool) -> dict[str, str]:
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.writelines(f"{k}={v}\n" for k, v in items)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def resolve_secrets(
+    keys: list[str], existing: dict[str, str], force: bool, env: dict[str, str]
+) -> dict[str, str]:
     """For each key, return env or existing or generated secret."""
     resolved: dict[str, str] = {}
+    to_generate: list[str] = []
     for key in keys:
-        val = os.environ.get(key) or existing.get(key)
+        env_val = env.get(key)
+        val = env_val or existing.get(key)
         if val and not force:
             resolved[key] = val
+        elif key == "SESSION_SECRET" and env_val:
+            resolved[key] = env_val
+        elif key in GENERATED_SECRETS:
+            to_generate.append(key)
         else:
-            if key == "REDIS_PASSWORD":
-                resolved[key] = secrets.token_urlsafe(24)
-            elif key in ("KEYCLOAK_ADMIN_PASSWORD", "KEYCLOAK_DB_PASSWORD"):
-                resolved[key] = secrets.token_urlsafe(24)
-            elif key == "QDRANT_API_KEY":
-                resolved[key] = secrets.token_urlsafe(24)
-            elif key == "SESSION_SECRET":
-                resolved[key] = os.environ.get(key) or secrets.token_hex(32)
-            elif key == "OPENAI_API_KEY":
-                resolved[key] = os.environ.get(key) or ""
-            else:
-                resolved[key] = os.environ.get(key) or ""
+            resolved[key] = env_val or ""
+    # One urandom read for all generated secrets, sliced per key.
+    pool = os.urandom(sum(GENERATED_SECRETS[k][1] for k in to_generate))
+    offset = 0
+    for key in to_generate:
+        encoding, nbytes = GENERATED_SECRETS[key]
+        raw = pool[offset:offset + nbytes]
+        offset += nbytes
+        resolved[key] = raw.hex() if encoding == "hex" else base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
     return resolved
 
 
-def replace_placeholders(data: dict[str, str], secrets_map: dict[str, str]) -> dict[str, str]:
+def replace_placeholders(
+    data: dict[str, str], secrets_map: dict[str, str], env: dict[str, str]
+) -> dict[str, str]:
     """Replace any value __KEY__ with actual value from secrets or env."""
+    def lookup(var_name: str) -> str:
+        return secrets_map.get(var_name) or env.get(var_name) or ""
+
+    def sub_inline(match: re.Match[str]) -> str:
+        return lookup(match.group(1))
+
+    # Whole-value secret placeholders resolve by dict hit; empty secrets still fall back to env.
+    placeholders = {f"__{k}__": v for k, v in secrets_map.items() if v}
     out: dict[str, str] = {}
     for k, v in data.items():
         v = (v or "").strip()
-        if is_placeholder(v):
-            var_name = PLACEHOLDER_RE.match(v).group(1)
-            out[k] = secrets_map.get(var_name) or os.environ.get(var_name) or ""
-        else:
-            out[k] = PLACEHOLDER_INLINE_RE.sub(
-                lambda match: secrets_map.get(match.group(1)) or os.environ.get(match.group(1)) or "",
-                v
-            )
+        # Most values (URLs, hosts, numbers) contain no "__": skip both regexes for them.
+        if "__" not in v:
+            out[k] = v
+            continue
+        repl = placeholders.get(v)
+        if repl is not None:
+            out[k] = repl
+            continue
+        name = placeholder_name(v)
+        out[k] = lookup(name) if name else PLACEHOLDER_INLINE_RE.sub(sub_inline, v)
     return out
 
 
+def missing_required(data: dict[str, str]) -> list[str]:
+    """Required keys that are absent or empty (any one of KV_URL_KEYS satisfies the KV store)."""
+    missing = [k for k in REQUIRED_KEYS if not (data.get(k) or "").strip()]
+    if not any((data.get(k) or "").strip() for k in KV_URL_KEYS):
+        missing.append("KEY_VALUE_STORE_URL|REDIS_URL")
+    return missing
+
+
 def main() -> None:
     ap = argparse.ArgumentParser(description="Generate .env from fullstack template.")
     ap.add_argument("--verify", action="store_true", help="Only validate existing .env")
@@ -137,11 +199,7 @@ def main() -> None:
     if args.verify:
         if not env_file.exists():
             raise SystemExit(".env: file not found")
-        data = parse_env_file(env_file)
-        required = SECRET_KEYS + ["QDRANT_URL", "QDRANT_COLLECTION"]
-        missing = [k for k in required if k not in data or not (data.get(k) or "").strip()]
-        if not any((data.get(k) or "").strip() for k in KV_URL_KEYS):
-            missing.append("KEY_VALUE_STORE_URL|REDIS_URL")
+        missing = missing_required(collect_env_keys(env_file, VERIFY_KEYS))
         if missing:
             raise SystemExit(f".env: missing or empty: {', '.join(missing)}")
         print("Verify OK: .env has required keys.")
@@ -150,10 +208,14 @@ def main() -> None:
     if not env_tpl.exists():
         raise SystemExit("Need scripts/env/.env.template (fullstack) to generate .env")
 
+    # Plain-dict snapshot: lookups below skip the os.environ mapping wrapper.
+    env = dict(os.environ)
     existing = parse_env_file(env_file)
-    secrets_map = resolve_secrets(SECRET_KEYS, existing, args.force)
-    data = parse_env_file(env_tpl)
-    data = replace_placeholders(data, secrets_map)
+    secrets_map = resolve_secrets(SECRET_KEYS, existing, args.force, env)
+    template = parse_env_file(env_tpl)
+    # Parsed dicts keep file order, so the template's key order comes from the same single read.
+    key_order = list(template)
+    data = replace_placeholders(template, secrets_map, env)
     for k, v in DEV_DEFAULTS.items():
         if k not in data or not (data.get(k) or "").strip():
             data[k] = v
@@ -161,14 +223,11 @@ def main() -> None:
         if k not in data or not (data.get(k) or "").strip():
             data[k] = secrets_map.get(k, "")
 
-    key_order = [line.strip().split("=")[0] for line in read_env_lines(env_tpl) if re.match(r"^[A-Za-z_][A-Za-z0-9_]*=", line.strip())]
     write_env_file(env_file, data, key_order=key_order if key_order else None)
     print("Wrote .env (fullstack: infra + app + auth).")
 
-    data = parse_env_file(env_file)
-    missing = [k for k in SECRET_KEYS + ["QDRANT_URL", "QDRANT_COLLECTION"] if k not in data or not (data.get(k) or "").strip()]
-    if not any((data.get(k) or "").strip() for k in KV_URL_KEYS):
-        missing.append("KEY_VALUE_STORE_URL|REDIS_URL")
+    # Check what was just written from memory; write_env_file emits exactly these pairs.
+    missing = missing_required(data)
     if missing:
         raise SystemExit(f".env: missing or empty after write: {', '.join(missing)}")
 
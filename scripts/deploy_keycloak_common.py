@@ -0,0 +1,363 @@
+"""
+Shared helpers for the Keycloak deploy scripts (deploy-configure-keycloak-realms.py,
+deploy-configure-keycloak-google-idp.py): .env loading, admin token, and a keep-alive
+replacement for urllib.request.urlopen with the Admin API call helpers built on it
+(admin_api / admin_create). Not an entrypoint; the scripts import it from
+their own directory (Python puts the script directory on sys.path). `base_url` arguments are
+the Keycloak origin without a trailing slash; callers normalise KEYCLOAK_URL once in main().
+
+The admin token is cached in $XDG_RUNTIME_DIR (per-user, mode 0600) so chained script
+runs skip the master-realm password grant; without XDG_RUNTIME_DIR nothing is cached.
+An Admin API 401 (token revoked, expired mid-run, or cached from a recreated Keycloak)
+drops the cache entry, fetches a fresh token and retries the call once.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import http.client
+import io
+import json
+import os
+import select
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections.abc import Container
+from email.message import Message
+from pathlib import Path
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # optional; CI and most dev hosts run these scripts with bare python3
+    orjson = None
+
+
+def json_dumps(obj: object) -> bytes:
+    """UTF-8 JSON request body (orjson when installed, else stdlib json)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def json_loads(data: bytes | str) -> Any:
+    """Decode a JSON response body (orjson when installed, else stdlib json)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# One HTTP/1.1 connection per Keycloak origin and thread (realm workers run in parallel).
+_KEEPALIVE = threading.local()
+
+# Safe to re-send after a dropped connection: repeating them cannot create anything twice.
+_IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+
+
+class _KeepAliveResponse:
+    """urlopen-style response whose body is read eagerly so the socket can serve the next call."""
+
+    def __init__(self, status: int, headers: Message, body: bytes) -> None:
+        self.status = status
+        self.headers = headers
+        self._body = body
+
+    def read(self) -> bytes:
+        return self._body
+
+    def __enter__(self) -> _KeepAliveResponse:
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        return None
+
+
+def _peer_closed(conn: http.client.HTTPConnection) -> bool:
+    """True when an idle keep-alive socket is readable, i.e. the server has closed (or reset) it."""
+    if conn.sock is None:
+        return False
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+def keepalive_urlopen(req: urllib.request.Request, timeout: float = 15) -> _KeepAliveResponse:
+    """
+    Drop-in for urllib.request.urlopen that keeps the connection to Keycloak open.
+    urlopen sends `Connection: close`, so every Admin API call paid a new TCP (and TLS)
+    handshake; one run makes well over a hundred calls. Raises urllib.error.HTTPError for
+    4xx/5xx like urlopen, so callers keep their error handling. Falls back to urlopen when
+    a proxy applies to the URL.
+    """
+    parts = urllib.parse.urlsplit(req.full_url)
+    if parts.scheme in urllib.request.getproxies() and not urllib.request.proxy_bypass(parts.hostname or ""):
+        return urllib.request.urlopen(req, timeout=timeout)
+    key = (parts.scheme, parts.netloc)
+    path = parts.path or "/"
+    if parts.query:
+        path = f"{path}?{parts.query}"
+    method = req.get_method()
+    headers = dict(req.header_items())
+    connections: dict[tuple[str, str], http.client.HTTPConnection] | None = getattr(_KEEPALIVE, "connections", None)
+    if connections is None:
+        connections = _KEEPALIVE.connections = {}
+    for attempt in (1, 2):
+        conn = connections.get(key)
+        if conn is not None and _peer_closed(conn):
+            conn.close()
+            connections.pop(key, None)
+            conn = None
+        reused = conn is not None
+        if conn is None:
+            conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            conn = conn_cls(parts.netloc, timeout=timeout)
+            connections[key] = conn
+        sent = False
+        try:
+            conn.request(method, path, body=req.data, headers=headers)
+            sent = True
+            resp = conn.getresponse()
+            body = resp.read()
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            connections.pop(key, None)
+            # Keycloak may drop an idle keep-alive socket between calls; retry once on a fresh one.
+            # A POST that may have reached Keycloak is not re-sent: the retry would 409.
+            if (
+                reused
+                and attempt == 1
+                and isinstance(e, (http.client.HTTPException, ConnectionError))
+                and (not sent or method in _IDEMPOTENT_METHODS)
+            ):
+                continue
+            raise urllib.error.URLError(e) from e
+        if resp.will_close:
+            conn.close()
+            connections.pop(key, None)
+        if resp.status >= 400:
+            raise urllib.error.HTTPError(req.full_url, resp.status, resp.reason, resp.headers, io.BytesIO(body))
+        return _KeepAliveResponse(resp.status, resp.headers, body)
+    raise AssertionError("unreachable")
+
+
+def _admin_call(
+    base_url: str,
+    token: str,
+    method: str,
+    path: str,
+    error: str,
+    body: Any,
+    allow: Container[int],
+) -> tuple[Message, bytes]:
+    url = f"{base_url}{path}"
+    data = json_dumps(body) if body is not None else None
+    token = _current_token(token)
+    for attempt in (1, 2):
+        req = urllib.request.Request(url, data=data, method=method)
+        req.add_header("Authorization", f"Bearer {token}")
+        if data is not None:
+            req.add_header("Content-Type", "application/json")
+        try:
+            with keepalive_urlopen(req, timeout=15) as resp:
+                return resp.headers, resp.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 401 and attempt == 1:
+                fresh = _refresh_admin_token(token)
+                if fresh is not None:
+                    token = fresh
+                    continue
+            if e.code in allow:
+                raise
+            err_body = e.read().decode() if e.fp else ""
+            sys.exit(f"{error} failed: {e.code} {err_body}")
+    raise AssertionError("unreachable")
+
+
+def admin_api(
+    base_url: str,
+    token: str,
+    method: str,
+    path: str,
+    error: str,
+    body: Any = None,
+    *,
+    allow: Container[int] = (),
+) -> Any:
+    """
+    One Admin API call (`path` starts with /admin/...): Bearer auth, JSON body when given,
+    decoded JSON response (None when empty). HTTP errors whose status is in `allow` are
+    re-raised as HTTPError for the caller; any other exits with "<error> failed: <code> <body>".
+    """
+    _, raw = _admin_call(base_url, token, method, path, error, body, allow)
+    return json_loads(raw) if raw.strip() else None
+
+
+def admin_create(
+    base_url: str,
+    token: str,
+    path: str,
+    error: str,
+    body: Any,
+    *,
+    allow: Container[int] = (),
+) -> str | None:
+    """POST like admin_api; returns the new id (Location header, else `id` in the response body)."""
+    headers, raw = _admin_call(base_url, token, "POST", path, error, body, allow)
+    location = headers.get("Location")
+    if location:
+        return location.rstrip("/").split("/")[-1]
+    data = json_loads(raw) if raw.strip() else None
+    new_id = data.get("id") if isinstance(data, dict) else None
+    return new_id if isinstance(new_id, str) and new_id else None
+
+
+def load_env_file(path: Path) -> dict[str, str]:
+    out: dict[str, str] = {}
+    if not path.is_file():
+        return out
+    with path.open() as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if "=" in line:
+                k, _, v = line.partition("=")
+                out[k.strip()] = v.strip().strip('"').strip("'")
+    return out
+
+
+def get_env(root: Path) -> dict[str, str]:
+    env: dict[str, str] = {}
+    for name in (".env",):
+        env.update(load_env_file(root / name))
+    for k, v in os.environ.items():
+        if v is not None:
+            env[k] = v
+    return env
+
+
+def _token_cache_path(base_url: str, admin_password: str) -> Path | None:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir or not os.path.isdir(runtime_dir):
+        return None
+    digest = hashlib.sha256(f"{base_url}\0{admin_password}".encode()).hexdigest()[:16]
+    return Path(runtime_dir) / f"kairos-keycloak-token-{digest}.json"
+
+
+def _read_cached_token(path: Path) -> str | None:
+    """
+    Cached token, reused only during the first half of its lifetime (master-realm admin tokens
+    default to 60 s). If it expires or is rejected mid-run, _admin_call refreshes it on the 401.
+    """
+    try:
+        cached = json_loads(path.read_bytes())
+    except (OSError, ValueError):
+        return None
+    token = cached.get("access_token") if isinstance(cached, dict) else None
+    issued_at = cached.get("issued_at") if isinstance(cached, dict) else None
+    expires_in = cached.get("expires_in") if isinstance(cached, dict) else None
+    if not isinstance(token, str) or not isinstance(issued_at, (int, float)) or not isinstance(expires_in, int):
+        return None
+    if time.time() >= issued_at + expires_in / 2:
+        return None
+    return token
+
+
+def _write_cached_token(path: Path, token: str, expires_in: int) -> None:
+    """Best effort: atomic replace of a 0600 file (mkstemp); cache failures never fail the run."""
+    try:
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".kairos-keycloak-token-")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(json_dumps({"access_token": token, "issued_at": time.time(), "expires_in": expires_in}))
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+# Where each token from get_admin_token came from, and which token replaced a rejected one,
+# so _admin_call can refresh on a 401 (once, shared by all realm worker threads).
+_TOKEN_SOURCES: dict[str, tuple[str, str]] = {}
+_TOKEN_REPLACEMENTS: dict[str, str] = {}
+_TOKEN_LOCK = threading.Lock()
+
+
+def _current_token(token: str) -> str:
+    """Latest replacement for `token`, so callers holding a rejected token skip the 401."""
+    while token in _TOKEN_REPLACEMENTS:
+        token = _TOKEN_REPLACEMENTS[token]
+    return token
+
+
+def _refresh_admin_token(rejected: str) -> str | None:
+    """
+    Fresh token after `rejected` got a 401: its cache file is deleted and the password grant
+    runs again. None for tokens get_admin_token did not hand out (nothing to refresh from).
+    """
+    with _TOKEN_LOCK:
+        if rejected in _TOKEN_REPLACEMENTS:
+            return _current_token(rejected)
+        source = _TOKEN_SOURCES.get(rejected)
+        if source is None:
+            return None
+        base_url, admin_password = source
+        cache_path = _token_cache_path(base_url, admin_password)
+        if cache_path is not None:
+            try:
+                cache_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+        fresh = _fetch_admin_token(base_url, admin_password, cache_path)
+        if fresh == rejected:
+            return None
+        _TOKEN_SOURCES[fresh] = source
+        _TOKEN_REPLACEMENTS[rejected] = fresh
+        return fresh
+
+
+def get_admin_token(base_url: str, admin_password: str) -> str:
+    cache_path = _token_cache_path(base_url, admin_password)
+    token = _read_cached_token(cache_path) if cache_path is not None else None
+    if not token:
+        token = _fetch_admin_token(base_url, admin_password, cache_path)
+    with _TOKEN_LOCK:
+        _TOKEN_SOURCES[token] = (base_url, admin_password)
+    return token
+
+
+def _fetch_admin_token(base_url: str, admin_password: str, cache_path: Path | None) -> str:
+    """Master-realm password grant; writes the token cache when `cache_path` is set."""
+    url = f"{base_url}/realms/master/protocol/openid-connect/token"
+    data = urllib.parse.urlencode({
+        "grant_type": "password",
+        "client_id": "admin-cli",
+        "username": "admin",
+        "password": admin_password,
+    }).encode("utf-8")
+    req = urllib.request.Request(url, data=data, method="POST")
+    req.add_header("Content-Type", "application/x-www-form-urlencoded")
+    try:
+        with keepalive_urlopen(req, timeout=15) as resp:
+            body = json_loads(resp.read())
+    except urllib.error.HTTPError as e:
+        body = e.read().decode() if e.fp else ""
+        sys.exit(f"Admin token failed: {e.code} {body}")
+    token = body.get("access_token")
+    if not token:
+        sys.exit("No access_token in token response")
+    expires_in = body.get("expires_in")
+    if cache_path is not None and isinstance(expires_in, int) and expires_in > 0:
+        _write_cached_token(cache_path, token, expires_in)
+    return token
+